@@ -1,6 +1,21 @@
+import argparse
+import json
+import os
+import random
+import signal
+import sys
+import time
+import tracemalloc
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from copy import deepcopy
 from heapq import heappop, heappush
-from functools import cache
-from typing import NamedTuple, TypeAlias
+from functools import lru_cache
+from itertools import count, islice
+from math import inf
+from typing import NamedTuple, TextIO, TypeAlias
 
 InitField: TypeAlias = list[list[str]]
 Actions: TypeAlias = list[str]
@@ -23,17 +38,15 @@ MOVE_FORWARD = 'F'
 USE_COIN = COIN
 USE_KEY = KEY
 
+# states StateSpacePlanner may expand before rpg() falls back to RPGSimulator
+PLANNER_MAX_NODES = 100_000
+
 
 class Point(NamedTuple):
     x: int
     y: int
 
 
-class Move(NamedTuple):
-    point: Point
-    direction: str
-
-
 class ResultAction(NamedTuple):
     actions: Actions
     current_hp: int
@@ -58,11 +71,28 @@ class Enemy:
         return f'{enemy}(attack={self.attack!r}, hp={self.hp!r})'
 
 
+class PlayerSnapshot(NamedTuple):
+    level: int
+    hp: int
+    attack: int
+    defense: int
+    enemies_killed: int
+    coins: int
+    keys: int
+    health_kits: int
+
+
 class Player:
     START_LEVEL = 1
     START_HP = 3
     START_ATTACK = 1
     START_DEFENSE = 1
+    COUNTERS = {COIN: 'coins', KEY: 'keys', HEALTH: 'health_kits'}
+
+    __slots__ = (
+        'level', 'hp', 'attack', 'defense', 'enemies_killed',
+        'coins', 'keys', 'health_kits',
+    )
 
     def __init__(self):
         self.level = self.START_LEVEL
@@ -70,7 +100,9 @@ class Player:
         self.attack = self.START_ATTACK
         self.defense = self.START_DEFENSE
         self.enemies_killed = 0
-        self.bag = []
+        self.coins = 0
+        self.keys = 0
+        self.health_kits = 0
 
     def __str__(self) -> str:
         return (
@@ -83,6 +115,27 @@ class Player:
             f')'
         )
 
+    @property
+    def bag(self) -> list[str]:
+        return [
+            item
+            for item, counter in self.COUNTERS.items()
+            for _ in range(getattr(self, counter))
+        ]
+
+    def snapshot(self) -> PlayerSnapshot:
+        """Immutable and hashable copy of the player's state."""
+        return PlayerSnapshot(
+            level=self.level,
+            hp=self.hp,
+            attack=self.attack,
+            defense=self.defense,
+            enemies_killed=self.enemies_killed,
+            coins=self.coins,
+            keys=self.keys,
+            health_kits=self.health_kits,
+        )
+
     def register_defeated_enemy(self) -> None:
         self.enemies_killed += 1
         if not self.enemies_killed % 3:
@@ -99,13 +152,14 @@ class Player:
                 f'{item=} cannot be added to the backpack; it is possible '
                 f'to add one of these items: {", ".join(valid_items)}'
             )
-        self.bag.append(item)
+        counter = self.COUNTERS[item]
+        setattr(self, counter, getattr(self, counter) + 1)
 
     def use_item_from_bag(self, item: str) -> None:
-        try:
-            self.bag.remove(item)
-        except ValueError:
+        if not self.get_number_of_items_in_bag(item):
             raise ValueError(f'{item=!r} not in the bag')
+        counter = self.COUNTERS[item]
+        setattr(self, counter, getattr(self, counter) - 1)
 
     def equip_shield(self) -> None:
         self.defense += 1
@@ -114,7 +168,8 @@ class Player:
         self.attack += 1
 
     def get_number_of_items_in_bag(self, item: str) -> int:
-        return self.bag.count(item)
+        counter = self.COUNTERS.get(item)
+        return getattr(self, counter) if counter else 0
 
 
 class Board:
@@ -140,6 +195,21 @@ class Board:
         if not hasattr(self, 'player_point'):
             raise ValueError("there is no player's mark on the original map")
 
+        self.neighbors = {
+            point: self.neighbors_of(point) for point in self.valid_points
+        }
+        self.points = [
+            Point(*divmod(cell, self.width))
+            for cell in range(self.height * self.width)
+        ]
+        self.cell_neighbors: list[dict[str, int]] = [
+            {} for _ in self.points
+        ]
+        for point, n_points in self.neighbors.items():
+            self.cell_neighbors[self.to_cell(point)] = {
+                d: self.to_cell(p) for d, p in n_points.items()
+            }
+
     def __getitem__(self, point: Point) -> str:
         return self.grid[point.x][point.y]
 
@@ -152,8 +222,13 @@ class Board:
     def is_valid_point(self, point: Point) -> bool:
         return point in self.valid_points
 
-    @cache
+    def to_cell(self, point: Point) -> int:
+        return point.x * self.width + point.y
+
     def find_neighboring_points(self, point: Point) -> dict[str, Point]:
+        return self.neighbors[point]
+
+    def neighbors_of(self, point: Point) -> dict[str, Point]:
         n_points = {}
         for direction, (dx, dy) in self.MOVES.items():
             n_point = Point(x=point.x + dx, y=point.y + dy)
@@ -162,32 +237,193 @@ class Board:
         return n_points
 
 
+class ThreatMap:
+    """Damage the player receives on each cell from the enemies around it.
+
+    ``damage[cell]`` is the damage from all the neighbors of the cell and
+    ``dealt[cell]`` the damage the enemy on that cell deals, both indexed
+    like ``Board.cell_neighbors`` and for the player's current defense.
+    """
+
+    ATTACKERS = {ENEMY, DEMON_LORD}
+
+    def __init__(self, board: Board, defense: int) -> None:
+        self.board = board
+        self.damage = [0] * len(board.cell_neighbors)
+        self.dealt = [0] * len(board.cell_neighbors)
+        self.set_defense(defense)
+
+    def set_defense(self, defense: int) -> None:
+        self.defense = defense
+        self.damage = [0] * len(self.damage)
+        self.dealt = [0] * len(self.dealt)
+        for point in self.board.valid_points:
+            value = self.board[point]
+            if value in self.ATTACKERS:
+                damage = max(0, Enemy(value).attack - defense)
+                self.add_damage(self.board.to_cell(point), damage)
+
+    def remove_enemy(self, point: Point) -> None:
+        cell = self.board.to_cell(point)
+        self.add_damage(cell, -self.dealt[cell])
+
+    def add_damage(self, cell: int, damage: int) -> None:
+        self.dealt[cell] += damage
+        for n_cell in self.board.cell_neighbors[cell].values():
+            self.damage[n_cell] += damage
+
+    def damage_facing(self, cell: int, direction: str) -> int:
+        """Damage on the cell from all the neighbors but the one faced."""
+        n_cell = self.board.cell_neighbors[cell].get(direction)
+        if n_cell is None:
+            return self.damage[cell]
+        return self.damage[cell] - self.dealt[n_cell]
+
+
+@lru_cache(maxsize=4096)
+def fight_demon_lord(
+        hp: int,
+        attack: int,
+        health_kits: int,
+        damage: int) -> tuple[tuple[str, ...], int]:
+    """Actions and hp left fighting the demon lord from a cell where each of
+    its rounds deals the given damage (its own and the enemies' around, after
+    the player's defense): heal on the last hp point while there are health
+    kits, attack otherwise. The fight ends on the killing blow, even if the
+    player died before; the result is shared by all the searches."""
+    boss_hp = Enemy(DEMON_LORD).hp
+    actions = []
+    while True:
+        if hp == 1 and health_kits:
+            actions.append(HEALTH)
+            health_kits -= 1
+            hp = Player.START_HP
+        else:
+            boss_hp -= attack
+            actions.append(ATTACK)
+        if boss_hp <= 0:
+            break
+        hp -= damage
+    return tuple(actions), hp
+
+
+class SearchStats:
+    """Counters of RPGSimulator's searches, one record per round of
+    destroy_demon_lord (one find_optimal_actions run), summed over all the
+    simulators it is given to.
+
+    hook, if given, is called with the record of each round; with trace,
+    the records are also kept for dump_trace. Records hold the search's
+    nodes popped and pushed, its maximum heap size, the results collected
+    before it returned, the calls to and time spent in parse_move (damage
+    lookups included) and the round's time, and the round's outcome: point
+    and target reached, number of actions and hp left.
+    """
+
+    FIELDS = (
+        'popped', 'pushed', 'max_heap', 'results',
+        'parse_move_calls', 'parse_move_time', 'time',
+    )
+
+    def __init__(
+            self,
+            hook: Callable[[dict], None] | None = None,
+            trace: bool = False) -> None:
+        self.hook = hook
+        self.trace = trace
+        self.rounds = 0
+        self.totals = dict.fromkeys(self.FIELDS, 0)
+        self.records: list[dict] = []
+        self.current: dict = {}
+
+    def start(self) -> None:
+        self.current = dict.fromkeys(self.FIELDS, 0)
+        self.current['round'] = self.rounds
+
+    def add(self, **measures: float) -> None:
+        for field, n in measures.items():
+            if field == 'max_heap':
+                self.current[field] = max(self.current[field], n)
+            else:
+                self.current[field] += n
+
+    def end(self, **outcome) -> None:
+        self.current.update(outcome)
+        self.rounds += 1
+        for field in self.FIELDS:
+            if field == 'max_heap':
+                self.totals[field] = max(
+                    self.totals[field], self.current[field])
+            else:
+                self.totals[field] += self.current[field]
+        if self.trace:
+            self.records.append(self.current)
+        if self.hook:
+            self.hook(self.current)
+
+    def as_dict(self) -> dict:
+        return {'rounds': self.rounds, **self.totals}
+
+    def dump_trace(self, out: TextIO, **extra) -> None:
+        """Write the kept records as JSON lines, with the extra keys."""
+        for record in self.records:
+            print(json.dumps({**extra, **record}), file=out)
+
+
 class RPGSimulator:
     COINS_NEEDED = 3
     KEYS_NEEDED = 1
+    # sorted, so that node numbers order like (point, direction) pairs
+    DIRECTIONS = sorted(Board.MOVES)
 
-    def __init__(self, player: Player, board: Board) -> None:
+    def __init__(
+            self,
+            player: Player,
+            board: Board,
+            stats: SearchStats | None = None) -> None:
         self.player = player
         self.board = board
+        self.stats = stats
+        self.threat = ThreatMap(board=board, defense=player.defense)
+        self.nodes_expanded = 0
         self.is_game_ove = False
         self.actions_to_win: Actions = []
 
     def destroy_demon_lord(self) -> Actions:
         while not self.is_game_ove:
-            actions, hp, _, last_point = self.find_optimal_actions()
+            actions, hp, _, last_point = self.run_round()
             self.actions_to_win.extend(actions)
             self.player.set_new_hp_value(hp)
             self.update(actions=actions, last_point=last_point)
         return self.actions_to_win
 
+    def run_round(self) -> ResultAction:
+        if self.stats is None:
+            # no instrumentation: no overhead
+            return self.find_optimal_actions()
+
+        self.stats.start()
+        start = time.perf_counter()
+        result = self.find_optimal_actions()
+        self.stats.end(
+            time=time.perf_counter() - start,
+            point=list(result.last_action_point),
+            target=self.board[result.last_action_point],
+            actions=len(result.actions),
+            hp=result.current_hp,
+        )
+        return result
+
     def update(self, actions: Actions, last_point: Point) -> None:
         last_action = self.board[last_point]
         if last_action == DEMON_LORD:
             self.is_game_ove = True
         elif last_action == ENEMY:
             self.player.register_defeated_enemy()
+            self.threat.remove_enemy(last_point)
         elif last_action == SHIELD:
             self.player.equip_shield()
+            self.threat.set_defense(self.player.defense)
         elif last_action == DUAL_SWORDS:
             self.player.equip_dual_swords()
         elif last_action in {KEY, HEALTH, COIN}:
@@ -220,139 +456,1225 @@ class RPGSimulator:
         self.board.player_direction = player_direction
 
     def find_optimal_actions(self) -> ResultAction:
-        start_point = self.board.player_point
-        start_dir = self.board.player_direction
-        start_move = Move(point=start_point, direction=start_dir)
-        cur_hp = self.player.hp
-        actions = {start_move: []}
-        hp_table = {start_move: cur_hp}
-        self.board[start_point] = EMPTY
-
-        queue = [(-cur_hp, 0, start_move)]
+        board = self.board
+        start_point = board.player_point
+        start = self.to_node(
+            board.to_cell(start_point), board.player_direction)
+        size = len(board.cell_neighbors) * len(self.DIRECTIONS)
+        hp_table = [0] * size
+        parents = [-1] * size
+        deltas: list[Actions | None] = [None] * size
+        lengths = [0] * size
+        hp_table[start] = self.player.hp
+        board[start_point] = EMPTY
+
+        parse_move = self.parse_move
+        if self.stats is not None:
+            parse_move = self.timed_parse_move
+        popped, pushed, max_heap = 0, 1, 1
+
+        queue = [(-self.player.hp, 0, start)]
         result = []
         while queue:
-            hp, steps, move = heappop(queue)
-            neighbors = self.board.find_neighboring_points(move.point)
-
-            if self.board[move.point] != EMPTY:
-                objects = [
-                    self.board[p] for d, p in neighbors.items()
-                    if d != move.direction
-                ]
-                received_damage = self.calculate_received_damage(objects)
-                result_hp = hp_table[move]
-
-                res = ResultAction(
-                    actions=actions[move],
-                    current_hp=result_hp,
-                    received_damage_next_step=received_damage,
-                    last_action_point=move.point,
-                )
-                if not received_damage and result_hp == self.player.START_HP:
-                    return res
+            hp, steps, node = heappop(queue)
+            popped += 1
+            cell, direction = self.from_node(node)
+
+            if board[board.points[cell]] != EMPTY:
+                received_damage = self.threat.damage_facing(cell, direction)
+                res = (hp_table[node], received_damage, lengths[node], node)
+                if not received_damage and res[0] == self.player.START_HP:
+                    self.count_search(popped, pushed, max_heap, len(result))
+                    return self.result_action(parents, deltas, res)
                 result.append(res)
                 continue
 
-            objects_around = [self.board[p] for p in neighbors.values()]
-            next_moves = []
-
-            for d, point in neighbors.items():
-                p = point if d == move.direction else move.point
-                next_moves.append(Move(point=p, direction=d))
-
-            for i, next_move in enumerate(next_moves):
-                objs = (
-                        [objects_around[i]]
-                        + objects_around[:i]
-                        + objects_around[i + 1:]
-                )
-                r_actions, r_hp = self.parse_move(
-                    cur_move=next_move,
-                    prev_move=move,
+            for d, n_cell in board.cell_neighbors[cell].items():
+                r_actions, r_hp = parse_move(
+                    cell=cell,
+                    direction=direction,
+                    next_direction=d,
                     hp=hp * -1,
-                    objects=objs,
+                    cell_value=board[board.points[n_cell]],
                 )
                 if not r_actions:
                     continue
 
-                if next_move not in hp_table or hp_table[next_move] < r_hp:
-                    actions[next_move] = actions[move] + r_actions
-                    hp_table[next_move] = r_hp
-                    heappush(queue, (-r_hp, steps + 1, next_move))
-
-        return min(
-            result,
-            key=lambda r: (
-                -r.current_hp,
-                r.received_damage_next_step,
-                len(r.actions),
-            ),
+                next_node = self.to_node(n_cell if d == direction else cell, d)
+                if hp_table[next_node] < r_hp:
+                    hp_table[next_node] = r_hp
+                    parents[next_node] = node
+                    deltas[next_node] = r_actions
+                    lengths[next_node] = lengths[node] + len(r_actions)
+                    heappush(queue, (-r_hp, steps + 1, next_node))
+                    pushed += 1
+                    if len(queue) > max_heap:
+                        max_heap = len(queue)
+
+        self.count_search(popped, pushed, max_heap, len(result))
+        res = min(result, key=lambda r: (-r[0], r[1], r[2]))
+        return self.result_action(parents, deltas, res)
+
+    def count_search(
+            self,
+            popped: int,
+            pushed: int,
+            max_heap: int,
+            results: int) -> None:
+        self.nodes_expanded += popped
+        if self.stats is not None:
+            self.stats.add(
+                popped=popped,
+                pushed=pushed,
+                max_heap=max_heap,
+                results=results,
+            )
+
+    def timed_parse_move(self, **move) -> tuple[Actions, int]:
+        start = time.perf_counter()
+        parsed = self.parse_move(**move)
+        self.stats.add(
+            parse_move_calls=1,
+            parse_move_time=time.perf_counter() - start,
+        )
+        return parsed
+
+    def to_node(self, cell: int, direction: str) -> int:
+        return cell * len(self.DIRECTIONS) + self.DIRECTIONS.index(direction)
+
+    def from_node(self, node: int) -> tuple[int, str]:
+        cell, direction = divmod(node, len(self.DIRECTIONS))
+        return cell, self.DIRECTIONS[direction]
+
+    def result_action(
+            self,
+            parents: list[int],
+            deltas: list[Actions | None],
+            res: tuple[int, int, int, int]) -> ResultAction:
+        hp, received_damage, _, node = res
+        cell, _ = self.from_node(node)
+        chunks = []
+        while parents[node] >= 0:
+            chunks.append(deltas[node])
+            node = parents[node]
+        return ResultAction(
+            actions=[action for chunk in reversed(chunks) for action in chunk],
+            current_hp=hp,
+            received_damage_next_step=received_damage,
+            last_action_point=self.board.points[cell],
         )
 
     def parse_move(
             self,
-            cur_move: Move,
-            prev_move: Move,
+            cell: int,
+            direction: str,
+            next_direction: str,
             hp: int,
-            objects: list[str]) -> tuple[Actions, int]:
+            cell_value: str) -> tuple[Actions, int]:
 
-        cell_value, *objects_around = objects
         actions = []
 
-        if prev_move.direction != cur_move.direction:
-            actions.append(cur_move.direction)
-            hp -= self.calculate_received_damage(objects)
+        if direction != next_direction:
+            actions.append(next_direction)
+            hp -= self.threat.damage[cell]
 
         elif cell_value in {COIN, SHIELD, DUAL_SWORDS, HEALTH, KEY, EMPTY}:
             actions.append(MOVE_FORWARD)
-            hp -= self.calculate_received_damage(objects_around)
+            hp -= self.threat.damage_facing(cell, direction)
 
         elif cell_value == MERCHANT:
-            cur_coins = self.player.get_number_of_items_in_bag(COIN)
-            if cur_coins >= self.COINS_NEEDED:
+            if self.player.coins >= self.COINS_NEEDED:
                 actions.extend([USE_COIN] * self.COINS_NEEDED)
 
         elif cell_value in {DOOR1, DOOR2}:
-            cur_keys = self.player.get_number_of_items_in_bag(KEY)
-            if cur_keys >= self.KEYS_NEEDED:
+            if self.player.keys >= self.KEYS_NEEDED:
                 actions.append(USE_KEY)
 
         elif cell_value == ENEMY:
             actions.append(ATTACK)
-            hp -= self.calculate_received_damage(objects_around)
+            hp -= self.threat.damage_facing(cell, direction)
 
         else:
-            boss_hp = Enemy(DEMON_LORD).hp
-            first_aid_kit = self.player.get_number_of_items_in_bag(HEALTH)
-
-            while True:
-                if hp == 1 and first_aid_kit:
-                    actions.append(HEALTH)
-                    first_aid_kit -= 1
-                    hp = self.player.START_HP
-                else:
-                    boss_hp -= self.player.attack
-                    actions.append(ATTACK)
-                if boss_hp <= 0:
-                    break
-                hp -= self.calculate_received_damage(objects)
+            fight, hp = fight_demon_lord(
+                hp=hp,
+                attack=self.player.attack,
+                health_kits=self.player.health_kits,
+                damage=self.threat.damage[cell],
+            )
+            actions.extend(fight)
 
         return ([], 0) if not actions or hp <= 0 else (actions, hp)
 
-    def calculate_received_damage(self, objects: list[str]) -> int:
-        received_damage = 0
-        player_defense = self.player.defense
-        enemies = [
-            Enemy(obj) for obj in objects if obj in {DEMON_LORD, ENEMY}
+
+class PlanningBudgetExceeded(RuntimeError):
+    pass
+
+
+class SearchState(NamedTuple):
+    cell: int
+    direction: str
+    hp: int
+    health_kits: int
+    consumed: int
+
+
+class StateSpacePlanner:
+    """Plan the whole dungeon with a single A* search.
+
+    A state is the player's cell and direction, hp, health kits and a bitmask
+    of the objects already consumed (picked up, killed, opened or paid); coins,
+    keys, attack and defense are all derived from that bitmask and from the
+    snapshot of the player (by default, a new one) taken by the planner. Moves
+    follow the rules of ``RPGSimulator.parse_move``, the cost of a state is the
+    number of actions taken to reach it. The search gives up with
+    PlanningBudgetExceeded after expanding max_nodes states (None: never).
+
+    With macro, the moves go from object to object (see corridor_states)
+    instead of cell by cell: the plans are as short, with far fewer states
+    to expand, but each of them costs more.
+    """
+
+    ITEMS = {COIN, SHIELD, DUAL_SWORDS, HEALTH, KEY}
+    TURNS = {direction: (direction,) for direction in Board.MOVES}
+    FORWARD = (MOVE_FORWARD,)
+    PAY = (USE_COIN,) * RPGSimulator.COINS_NEEDED
+    OPEN = (USE_KEY,)
+    STRIKE = (ATTACK,)
+
+    def __init__(
+            self,
+            board: Board,
+            player: Player | None = None,
+            weight: float = 1.0,
+            max_nodes: int | None = PLANNER_MAX_NODES,
+            macro: bool = False) -> None:
+        self.board = board
+        self.player = (player or Player()).snapshot()
+        self.weight = weight
+        self.max_nodes = max_nodes
+        self.moves = self.corridor_states if macro else self.next_states
+        self.objects: dict[int, int] = {}
+        self.masks = {
+            kind: 0 for kind in
+            (COIN, SHIELD, DUAL_SWORDS, HEALTH, KEY, ENEMY, MERCHANT, DOOR1)
+        }
+        self.neighbors = board.cell_neighbors
+        self.values: dict[int, str] = {}
+        self.attacks: dict[int, int] = {}
+        self.demon_lord = -1
+        # (attack, defense, coins, keys) of each consumed bitmask met
+        self.inventories: dict[int, tuple[int, int, int, int]] = {}
+
+        for point in board.valid_points:
+            cell = board.to_cell(point)
+            value = board[point]
+            if value in board.MOVES:
+                value = EMPTY
+            self.values[cell] = value
+            if value in ThreatMap.ATTACKERS:
+                self.attacks[cell] = Enemy(value).attack
+            if value == DEMON_LORD:
+                self.demon_lord = cell
+            elif value != EMPTY:
+                bit = 1 << len(self.objects)
+                self.objects[cell] = bit
+                self.masks[DOOR1 if value == DOOR2 else value] |= bit
+
+        if self.demon_lord < 0:
+            raise ValueError('there is no demon lord on the original map')
+        # (cell, attack, bit) of the enemies around each cell
+        self.attackers = [
+            [
+                (n_cell, self.attacks[n_cell], self.objects.get(n_cell, 0))
+                for n_cell in n_cells.values() if n_cell in self.attacks
+            ]
+            for n_cells in self.neighbors
         ]
-        for enemy in enemies:
-            received_damage += max(0, (enemy.attack - player_defense))
+        self.distances = self.distances_from(self.demon_lord)
+        # steps from the dual swords and shields, for their detours
+        self.item_distances = {
+            cell: self.distances_from(cell)
+            for cell, bit in self.objects.items()
+            if bit & (self.masks[DUAL_SWORDS] | self.masks[SHIELD])
+            and cell in self.distances
+        }
+        self.boss_attacks = self.boss_attacks_table()
+        self.fight_costs: dict[tuple[int, int, int, int], float] = {}
+        # (touched bits, their consumed bits, corridors) of each node
+        self.corridor_cache: dict[
+            tuple[int, str], list[tuple[int, int, list[tuple]]]] = {}
+        self.link_cache: dict[tuple[int, str], tuple[int, list[tuple]]] = {}
+        self.nodes_expanded = 0
+
+    def value(self, cell: int, consumed: int) -> str:
+        if consumed & self.objects.get(cell, 0):
+            return EMPTY
+        return self.values[cell]
+
+    def distances_from(self, source: int) -> dict[int, int]:
+        """Number of steps from each cell to the source, ignoring
+        everything but the walls."""
+        distances = {source: 0}
+        queue = deque([source])
+        while queue:
+            cell = queue.popleft()
+            for n_cell in self.neighbors[cell].values():
+                if n_cell not in distances:
+                    distances[n_cell] = distances[cell] + 1
+                    queue.append(n_cell)
+        return distances
+
+    def heuristic(self, state: SearchState) -> float:
+        """Lower bound on the actions left (inf: the demon lord cannot be
+        defeated anymore): the steps to the demon lord, one turn if the player
+        does not face a cell closer to it, and the cheapest way to defeat it
+        (see fight_cost)."""
+        cell, direction, _, _, consumed = state
+        distance = self.distances.get(cell)
+        if distance is None:
+            return inf
+        facing = self.neighbors[cell].get(direction)
+        turn = self.distances.get(facing, distance) != distance - 1
+        key = (
+            cell,
+            consumed & self.masks[DUAL_SWORDS],
+            consumed & self.masks[SHIELD],
+            (consumed & self.masks[ENEMY]).bit_count(),
+        )
+        if key not in self.fight_costs:
+            self.fight_costs[key] = self.fight_cost(*key)
+        return distance - 1 + turn + self.fight_costs[key]
+
+    def fight_cost(
+            self,
+            cell: int,
+            swords: int,
+            shields: int,
+            kills: int) -> float:
+        """Fewest actions to get an attack and a defense able to defeat the
+        demon lord and attack it, from the cell: the dual swords and shields
+        picked up cost at least the detour to go by the farthest of them,
+        each level up the kills it needs."""
+        distance = self.distances[cell]
+        player = self.player
+        killed = player.enemies_killed + kills
+        attack = (
+            player.attack
+            + swords.bit_count()
+            + killed // 3
+            - player.enemies_killed // 3
+        )
+        defense = player.defense + shields.bit_count()
+        levels = (
+            (killed + self.masks[ENEMY].bit_count() - kills) // 3
+            - killed // 3
+        )
+        sword_detours = self.detours(cell, distance, DUAL_SWORDS, swords)
+        shield_detours = self.detours(cell, distance, SHIELD, shields)
+        cost = inf
+        # the detours only grow: stop as soon as they alone cost too much
+        for n_shields, shield_detour in enumerate(shield_detours):
+            if shield_detour >= cost:
+                break
+            boss_attacks = self.boss_attacks[defense + n_shields]
+            for n_swords, sword_detour in enumerate(sword_detours):
+                detour = max(shield_detour, sword_detour)
+                if detour >= cost:
+                    break
+                for n_levels in range(levels + 1):
+                    kills_needed = (
+                        3 * (killed // 3 + n_levels) - killed
+                        if n_levels else 0
+                    )
+                    cost = min(cost, detour + kills_needed + boss_attacks[
+                        attack + n_swords + n_levels])
+        return cost
+
+    def detours(
+            self,
+            cell: int,
+            distance: int,
+            kind: str,
+            consumed: int) -> list[int]:
+        """The least detours to go by none, one, two... of the objects of
+        that kind left, on the way from the cell to the demon lord."""
+        detours = sorted(
+            distances[cell] + self.distances[item] - distance
+            for item, distances in self.item_distances.items()
+            if self.objects[item] & self.masks[kind] & ~consumed
+            and cell in distances
+        )
+        return [0] + detours
+
+    def boss_attacks_table(self) -> list[list[float]]:
+        """Attacks needed to defeat the demon lord for each defense and
+        attack the player can reach, inf if the player dies first even with
+        all the health kits."""
+        player = self.player
+        max_attack = (
+            player.attack
+            + self.masks[DUAL_SWORDS].bit_count()
+            + (player.enemies_killed + self.masks[ENEMY].bit_count()) // 3
+            - player.enemies_killed // 3
+        )
+        max_defense = player.defense + self.masks[SHIELD].bit_count()
+        health_kits = player.health_kits + self.masks[HEALTH].bit_count()
+        boss = Enemy(DEMON_LORD)
+        table = []
+        for defense in range(max_defense + 1):
+            table.append([inf])
+            for attack in range(1, max_attack + 1):
+                _, hp = fight_demon_lord(
+                    hp=Player.START_HP,
+                    attack=attack,
+                    health_kits=health_kits,
+                    damage=max(0, boss.attack - defense),
+                )
+                table[-1].append(-(-boss.hp // attack) if hp > 0 else inf)
+        return table
+
+    def received_damage(
+            self,
+            cell: int,
+            consumed: int,
+            defense: int,
+            exclude: int = -1) -> int:
+        received_damage = 0
+        for n_cell, attack, bit in self.attackers[cell]:
+            if n_cell != exclude and not consumed & bit:
+                received_damage += max(0, attack - defense)
         return received_damage
 
+    def plan(self) -> Actions:
+        """Shortest list of actions destroying the demon lord from the
+        player's mark on the board; with a weight above one, a list at most
+        that many times longer, found faster."""
+        player = self.player
+        start_state = SearchState(
+            cell=self.board.to_cell(self.board.player_point),
+            direction=self.board.player_direction,
+            hp=player.hp,
+            health_kits=player.health_kits,
+            consumed=0,
+        )
+        # best cost of each state, with the state and actions it comes from
+        best: dict[SearchState, tuple[int, SearchState | None, tuple]] = {
+            start_state: (0, None, ())}
+        expanded: dict[tuple[int, str, int], list[tuple]] = {}
+        pushed = count()
+        queue = [(self.heuristic(start_state), 0, 0, start_state, None)]
 
-def rpg(initial_field: InitField) -> list[str]:
+        while queue:
+            _, cost, _, state, final_actions = heappop(queue)
+            if final_actions is not None:
+                return self.rebuild_actions(best, state) + final_actions
+            if best[state][0] < cost or self.is_dominated(
+                    expanded, state, cost):
+                continue
+            if self.nodes_expanded == self.max_nodes:
+                raise PlanningBudgetExceeded(
+                    f'no plan found in {self.max_nodes} states')
+            self.nodes_expanded += 1
+
+            for actions, next_state, is_goal in self.moves(state):
+                next_cost = cost + len(actions)
+                if is_goal:
+                    heappush(queue, (
+                        next_cost, next_cost, next(pushed), state, actions))
+                    continue
+                if next_state in best and best[next_state][0] <= next_cost:
+                    continue
+                heuristic = self.heuristic(next_state)
+                if heuristic < inf:
+                    best[next_state] = (next_cost, state, actions)
+                    heappush(queue, (
+                        next_cost + self.weight * heuristic,
+                        next_cost,
+                        next(pushed),
+                        next_state,
+                        None,
+                    ))
+
+        raise ValueError('the demon lord cannot be defeated')
+
+    def is_dominated(
+            self,
+            expanded: dict[tuple[int, str, int], list[tuple]],
+            state: SearchState,
+            cost: int) -> bool:
+        """Whether a state expanded earlier at the same place dominates this
+        one: it was reached with no more actions and consumed a superset of
+        the objects, with no fewer hp, health kits, coins and keys left, so
+        everything this state can still do, that one can do at least as well.
+        Record the state as expanded otherwise."""
+        cell, direction, hp, health_kits, consumed = state
+        _, _, coins, keys = self.inventory(consumed)
+        for o_hp in range(hp, Player.START_HP + 1):
+            others = expanded.get((cell, direction, o_hp), ())
+            for o_consumed, o_health_kits, o_coins, o_keys, o_cost in others:
+                if (o_consumed & consumed == consumed
+                        and o_cost <= cost
+                        and o_health_kits >= health_kits
+                        and o_coins >= coins
+                        and o_keys >= keys):
+                    return True
+        expanded.setdefault((cell, direction, hp), []).append(
+            (consumed, health_kits, coins, keys, cost))
+        return False
+
+    def inventory(self, consumed: int) -> tuple[int, int, int, int]:
+        """Attack, defense, coins and keys once these objects consumed."""
+        if consumed in self.inventories:
+            return self.inventories[consumed]
+        player = self.player
+        masks = self.masks
+        attack = (
+            player.attack
+            + (consumed & masks[DUAL_SWORDS]).bit_count()
+            + (player.enemies_killed
+               + (consumed & masks[ENEMY]).bit_count()) // 3
+            - player.enemies_killed // 3
+        )
+        defense = player.defense + (consumed & masks[SHIELD]).bit_count()
+        coins = (
+            player.coins
+            + (consumed & masks[COIN]).bit_count()
+            - RPGSimulator.COINS_NEEDED
+            * (consumed & masks[MERCHANT]).bit_count()
+        )
+        keys = (
+            player.keys
+            + (consumed & masks[KEY]).bit_count()
+            - RPGSimulator.KEYS_NEEDED * (consumed & masks[DOOR1]).bit_count()
+        )
+        self.inventories[consumed] = (attack, defense, coins, keys)
+        return attack, defense, coins, keys
+
+    @staticmethod
+    def rebuild_actions(
+            best: dict[SearchState, tuple[int, SearchState | None, tuple]],
+            state: SearchState) -> Actions:
+        chunks = []
+        _, parent, actions = best[state]
+        while parent is not None:
+            chunks.append(actions)
+            _, parent, actions = best[parent]
+        return [action for chunk in reversed(chunks) for action in chunk]
+
+    def next_states(self, state: SearchState):
+        """(actions, next state, whether the demon lord is defeated) for
+        each move from the state; the actions of the plain moves are tuples
+        shared by all the states."""
+        cell, direction, hp, health_kits, consumed = state
+        _, defense, _, _ = self.inventory(consumed)
+        turn_hp = hp - self.received_damage(cell, consumed, defense)
+
+        for d, n_cell in self.neighbors[cell].items():
+            if d != direction:
+                if turn_hp > 0:
+                    yield self.TURNS[d], SearchState(
+                        cell, d, turn_hp, health_kits, consumed), False
+            else:
+                yield from self.facing_moves(state, n_cell)
+
+    def facing_moves(self, state: SearchState, n_cell: int):
+        """The move onto, or the interaction with, the cell the player
+        faces (see next_states)."""
+        cell, direction, hp, health_kits, consumed = state
+        attack, defense, coins, keys = self.inventory(consumed)
+        value = self.value(n_cell, consumed)
+        bit = self.objects.get(n_cell, 0)
+
+        if value == EMPTY or value in self.ITEMS:
+            r_hp = hp - self.received_damage(
+                cell, consumed, defense, exclude=n_cell)
+            if r_hp > 0:
+                yield self.FORWARD, SearchState(
+                    cell=n_cell,
+                    direction=direction,
+                    hp=r_hp,
+                    health_kits=health_kits + (value == HEALTH),
+                    consumed=consumed | bit,
+                ), False
+
+        elif value == MERCHANT:
+            if coins >= RPGSimulator.COINS_NEEDED:
+                yield self.PAY, SearchState(
+                    cell, direction, hp, health_kits, consumed | bit), False
+
+        elif value in {DOOR1, DOOR2}:
+            if keys >= RPGSimulator.KEYS_NEEDED:
+                yield self.OPEN, SearchState(
+                    cell, direction, hp, health_kits, consumed | bit), False
+
+        elif value == ENEMY:
+            r_hp = hp - self.received_damage(
+                cell, consumed, defense, exclude=n_cell)
+            if r_hp > 0:
+                yield self.STRIKE, SearchState(
+                    cell, direction, r_hp, health_kits, consumed | bit), False
+
+        else:
+            # fight_demon_lord heals on the last hp point even when the
+            # next attack wins: bring as few health kits as it takes, so
+            # that one more kit never makes a state worse
+            damage = self.received_damage(cell, consumed, defense)
+            for kits in range(health_kits + 1):
+                actions, r_hp = fight_demon_lord(
+                    hp=hp,
+                    attack=attack,
+                    health_kits=kits,
+                    damage=damage,
+                )
+                if r_hp > 0:
+                    yield list(actions), state, True
+                    break
+
+    def corridor_states(self, state: SearchState):
+        """Same as next_states, but each move goes along a corridor to an
+        object (see corridors) and interacts with it."""
+        cell, direction, hp, health_kits, consumed = state
+        for c, d, damage, actions in self.corridors(
+                cell, direction, consumed):
+            if damage >= hp:
+                continue
+            facing_state = SearchState(
+                c, d, hp - damage, health_kits, consumed)
+            facing = self.neighbors[c][d]
+            for more, next_state, is_goal in self.facing_moves(
+                    facing_state, facing):
+                if is_goal:
+                    yield [*actions, *more], next_state, True
+                else:
+                    yield actions + more, next_state, False
+
+    def corridors(
+            self,
+            cell: int,
+            direction: str,
+            consumed: int) -> list[tuple[int, str, int, tuple]]:
+        """(cell, direction, damage, actions) of the paths from the node to
+        every node facing an object or the demon lord: for each of them, the
+        shortest path and the shorter ones among those taking less damage.
+
+        The paths chain the links (see links) through the cells of the
+        objects already consumed. They are kept with the bits of the objects
+        they faced or were attacked by (and the shields, when they take
+        damage): they stay valid until one of these is consumed, whatever
+        happens elsewhere in the dungeon."""
+        cached = self.corridor_cache.setdefault((cell, direction), [])
+        for touched, key, found in cached:
+            if consumed & touched == key:
+                return found
+
+        _, defense, _, _ = self.inventory(consumed)
+        enemy_damage = max(0, Enemy.DEFAULT_ATTACK - defense)
+        boss_damage = max(0, Enemy(DEMON_LORD).attack - defense)
+        touched = self.masks[SHIELD] if enemy_damage or boss_damage else 0
+        alive = ~consumed
+        # (label it comes from, actions) of each cell of a consumed object
+        labels: list[tuple[int, tuple]] = [(-1, ())]
+        least: dict[tuple[int, str], int] = {}
+        queue = [(0, 0, 0, cell, direction)]
+        # (steps, damage, label, cell, direction, actions) of the objects
+        found = []
+        while queue:
+            steps, damage, index, c, d = heappop(queue)
+            if least.get((c, d), Player.START_HP) <= damage:
+                continue
+            least[c, d] = damage
+            bits, links = self.links(c, d)
+            touched |= bits
+            for end, e_d, facing, bit, paths in links:
+                # the paths are sorted by steps: only those taking less
+                # damage than the shorter ones count
+                least_damage = Player.START_HP
+                for e_steps, (once, twice, thrice), boss_hits, actions in (
+                        paths):
+                    e_damage = damage + boss_hits * boss_damage
+                    if enemy_damage and once & alive:
+                        e_damage += enemy_damage * (
+                            (once & alive).bit_count()
+                            + (twice & alive).bit_count()
+                            + (thrice & alive).bit_count())
+                    if e_damage >= least_damage:
+                        continue
+                    least_damage = e_damage
+                    if not consumed & bit:
+                        found.append((
+                            steps + e_steps, e_damage, index, end, e_d,
+                            actions))
+                    else:
+                        # the object is gone: step on its cell and go on
+                        # from there
+                        f_damage = e_damage + self.received_damage(
+                            end, consumed, defense)
+                        if f_damage < Player.START_HP:
+                            labels.append((index, actions + self.FORWARD))
+                            heappush(queue, (
+                                steps + e_steps + 1, f_damage,
+                                len(labels) - 1, facing, e_d))
+                    if e_damage == damage:
+                        break
+                if consumed & bit:
+                    for _, _, enemy_bit in self.attackers[end]:
+                        touched |= enemy_bit
+
+        corridors = []
+        ends: dict[tuple[int, str], int] = {}
+        for _, e_damage, index, end, e_d, actions in sorted(found):
+            if ends.get((end, e_d), Player.START_HP) <= e_damage:
+                continue
+            ends[end, e_d] = e_damage
+            chunks = [actions]
+            while index >= 0:
+                index, actions = labels[index]
+                chunks.append(actions)
+            corridors.append(
+                (end, e_d, e_damage, sum(reversed(chunks), ())))
+        cached.append((touched, consumed & touched, corridors))
+        return corridors
+
+    def links(self, cell: int, direction: str) -> tuple[int, list[tuple]]:
+        """The bits of the objects met and the (cell, direction, facing cell,
+        its bit, paths) of the nodes facing an object or the demon lord that
+        can be reached from the node by turn-aware paths over the cells empty
+        on the original map. The paths are (steps, enemies, demon lord
+        attacks, actions), sorted by steps.
+
+        The enemies are three bitmasks: those attacking the player at least
+        once, twice and three times on the way (the player cannot survive
+        more, unless they deal no damage). A path is kept unless a path as
+        short takes no more attacks of each. The links never change: they
+        are computed once for each node."""
+        node = (cell, direction)
+        if node in self.link_cache:
+            return self.link_cache[node]
+        max_hits = Player.START_HP
+        # label: (cell, direction, steps, enemies, demon lord attacks, label
+        # it comes from, action)
+        labels = [(cell, direction, 0, (0, 0, 0), 0, -1, '')]
+        # nodes reached without any attack: no other path can do better
+        safe = {node}
+        hits_at: dict[tuple[int, str], list[tuple[int, int, int, int]]] = {}
+        ends = []
+        neighbors, values, attackers = (
+            self.neighbors, self.values, self.attackers)
+        for index, (c, d, steps, hits, boss_hits, _, _) in enumerate(
+                labels):
+            n_cells = neighbors[c]
+            facing = n_cells.get(d)
+            blocked = facing is not None and values[facing] != EMPTY
+            if blocked:
+                ends.append(index)
+            once, twice, thrice = hits
+            for _, _, bit in attackers[c]:
+                if not bit:
+                    boss_hits = min(boss_hits + 1, max_hits)
+                elif not once & bit:
+                    once |= bit
+                elif not twice & bit:
+                    twice |= bit
+                else:
+                    thrice |= bit
+            hits = (once, twice, thrice)
+            attacked = once or boss_hits
+            for n_d, n_cell in n_cells.items():
+                if n_d != d:
+                    n_node = (c, n_d)
+                elif blocked:
+                    continue
+                else:
+                    n_node = (n_cell, d)
+                if n_node in safe:
+                    continue
+                if not attacked:
+                    safe.add(n_node)
+                else:
+                    others = hits_at.setdefault(n_node, [])
+                    if any(o_boss_hits <= boss_hits
+                           and not o_once & ~once
+                           and not o_twice & ~twice
+                           and not o_thrice & ~thrice
+                           for o_once, o_twice, o_thrice, o_boss_hits
+                           in others):
+                        continue
+                    others.append((once, twice, thrice, boss_hits))
+                labels.append((
+                    *n_node, steps + 1, hits, boss_hits, index,
+                    MOVE_FORWARD if n_d == d else n_d))
+
+        bits = 0
+        paths_to: dict[tuple[int, str], tuple] = {}
+        for index in ends:
+            c, d, steps, hits, boss_hits, parent, action = labels[index]
+            actions = []
+            while parent >= 0:
+                actions.append(action)
+                _, _, _, _, _, parent, action = labels[parent]
+            if (c, d) not in paths_to:
+                facing = self.neighbors[c][d]
+                bit = self.objects.get(facing, 0)
+                paths_to[c, d] = (c, d, facing, bit, [])
+                bits |= bit
+            paths_to[c, d][4].append(
+                (steps, hits, boss_hits, tuple(reversed(actions))))
+            bits |= hits[0]
+        links = list(paths_to.values())
+        self.link_cache[node] = (bits, links)
+        return bits, links
+
+
+class ReplayResult(NamedTuple):
+    ok: bool
+    step: int
+    reason: str
+
+
+class ReplayEngine:
+    """Replay lists of actions on a dungeon and check every step against
+    the rules of the game.
+
+    The field is parsed once; a replay only tracks the player, their stats
+    and a bitmask of the objects consumed, so any number of lists can be
+    checked against the same engine without copying the grid. The result
+    of a replay tells whether it destroyed the demon lord, the index of the
+    first illegal action (or the number of actions) and the reason.
+    """
+
+    ITEMS = StateSpacePlanner.ITEMS
+
+    def __init__(self, initial_field: InitField) -> None:
+        self.board = board = Board(field=initial_field)
+        self.start = board.to_cell(board.player_point)
+        self.direction = board.player_direction
+        self.values = [WALL] * len(board.cell_neighbors)
+        self.objects: dict[int, int] = {}
+        self.attacks: dict[int, int] = {}
+        for point in board.valid_points:
+            cell = board.to_cell(point)
+            value = board[point]
+            self.values[cell] = EMPTY if value in board.MOVES else value
+            if value in ThreatMap.ATTACKERS:
+                self.attacks[cell] = Enemy(value).attack
+            if value not in board.MOVES and value != EMPTY:
+                self.objects[cell] = 1 << len(self.objects)
+
+    def replay(self, actions: Iterable[str]) -> ReplayResult:
+        neighbors, values, objects = (
+            self.board.cell_neighbors, self.values, self.objects)
+        cell, direction = self.start, self.direction
+        player = Player()
+        boss_hp = Enemy(DEMON_LORD).hp
+        consumed = 0
+        paid: dict[int, int] = {}
+        step = -1
+
+        for step, action in enumerate(actions):
+            if boss_hp <= 0:
+                return ReplayResult(
+                    False, step, 'the demon lord is already destroyed')
+            target = neighbors[cell].get(direction)
+            if target is None:
+                value = WALL
+            elif consumed & objects.get(target, 0):
+                value = EMPTY
+            else:
+                value = values[target]
+
+            if action in Board.MOVES:
+                direction = action
+                player.hp -= self.received_damage(
+                    cell, consumed, player.defense)
+
+            elif action == MOVE_FORWARD:
+                if value != EMPTY and value not in self.ITEMS:
+                    return ReplayResult(
+                        False, step, f'{value!r} blocks the way')
+                player.hp -= self.received_damage(
+                    cell, consumed, player.defense, exclude=target)
+                cell = target
+                if value == SHIELD:
+                    player.equip_shield()
+                elif value == DUAL_SWORDS:
+                    player.equip_dual_swords()
+                elif value != EMPTY:
+                    player.add_item_in_bag(value)
+                consumed |= objects.get(target, 0)
+
+            elif action == ATTACK and value == ENEMY:
+                consumed |= objects[target]
+                player.register_defeated_enemy()
+                player.hp -= self.received_damage(
+                    cell, consumed, player.defense)
+
+            elif action == ATTACK and value == DEMON_LORD:
+                boss_hp -= player.attack
+                if boss_hp > 0:
+                    player.hp -= self.received_damage(
+                        cell, consumed, player.defense)
+
+            elif action == ATTACK:
+                return ReplayResult(False, step, 'nothing to attack')
+
+            elif action == USE_COIN:
+                if value != MERCHANT:
+                    return ReplayResult(False, step, 'no merchant to pay')
+                if not player.coins:
+                    return ReplayResult(False, step, 'no coin in the bag')
+                player.use_item_from_bag(COIN)
+                paid[target] = paid.get(target, 0) + 1
+                if paid[target] == RPGSimulator.COINS_NEEDED:
+                    consumed |= objects[target]
+
+            elif action == USE_KEY:
+                if value not in {DOOR1, DOOR2}:
+                    return ReplayResult(False, step, 'no door to open')
+                if not player.keys:
+                    return ReplayResult(False, step, 'no key in the bag')
+                player.use_item_from_bag(KEY)
+                consumed |= objects[target]
+
+            elif action == HEALTH:
+                if not player.health_kits:
+                    return ReplayResult(
+                        False, step, 'no health kit in the bag')
+                player.use_item_from_bag(HEALTH)
+                player.hp = Player.START_HP - self.received_damage(
+                    cell, consumed, player.defense)
+
+            else:
+                return ReplayResult(False, step, f'unknown action {action!r}')
+
+            if player.hp <= 0:
+                return ReplayResult(False, step, 'the player died')
+
+        if boss_hp > 0:
+            return ReplayResult(
+                False, step + 1, 'the demon lord is still alive')
+        return ReplayResult(True, step + 1, 'ok')
+
+    def replay_many(
+            self,
+            sequences: Iterable[Iterable[str]]) -> Iterator[ReplayResult]:
+        for actions in sequences:
+            yield self.replay(actions)
+
+    def received_damage(
+            self,
+            cell: int,
+            consumed: int,
+            defense: int,
+            exclude: int | None = None) -> int:
+        received_damage = 0
+        for n_cell in self.board.cell_neighbors[cell].values():
+            attack = self.attacks.get(n_cell)
+            if (attack and n_cell != exclude
+                    and not consumed & self.objects[n_cell]):
+                received_damage += max(0, attack - defense)
+        return received_damage
+
+
+def validate(initial_field: InitField, actions: Iterable[str]) -> ReplayResult:
+    return ReplayEngine(initial_field).replay(actions)
+
+
+def validate_many(
+        initial_field: InitField,
+        sequences: Iterable[Iterable[str]]) -> Iterator[ReplayResult]:
+    """Validate many lists of actions against one parsed dungeon."""
+    return ReplayEngine(initial_field).replay_many(sequences)
+
+
+def rpg(
+        initial_field: InitField,
+        global_search: bool = False,
+        weight: float = 1.0,
+        max_nodes: int | None = PLANNER_MAX_NODES,
+        macro: bool = False) -> list[str]:
+    actions, _ = solve_dungeon(
+        initial_field, global_search,
+        weight=weight, max_nodes=max_nodes, macro=macro)
+    return actions
+
+
+def solve_dungeon(
+        initial_field: InitField,
+        global_search: bool = False,
+        stats: SearchStats | None = None,
+        weight: float = 1.0,
+        max_nodes: int | None = PLANNER_MAX_NODES,
+        macro: bool = False) -> tuple[Actions, int]:
+    """Actions destroying the demon lord and number of search nodes
+    expanded to find them; stats instrument RPGSimulator's rounds, weight,
+    max_nodes and macro are StateSpacePlanner's. When the planner runs out
+    of nodes, RPGSimulator takes over."""
     player = Player()
     board = Board(field=initial_field)
-    simulator = RPGSimulator(player=player, board=board)
-    return simulator.destroy_demon_lord()
-    
+    nodes_expanded = 0
+    if global_search:
+        planner = StateSpacePlanner(
+            board=board, player=player,
+            weight=weight, max_nodes=max_nodes, macro=macro)
+        try:
+            return planner.plan(), planner.nodes_expanded
+        except PlanningBudgetExceeded:
+            nodes_expanded = planner.nodes_expanded
+    simulator = RPGSimulator(player=player, board=board, stats=stats)
+    actions = simulator.destroy_demon_lord()
+    return actions, nodes_expanded + simulator.nodes_expanded
+
+
+def rpg_many(
+        fields: Iterable[InitField],
+        processes: int | None = None,
+        chunksize: int = 16,
+        timeout: float | None = None,
+        global_search: bool = False,
+        weight: float = 1.0,
+        max_nodes: int | None = PLANNER_MAX_NODES,
+        macro: bool = False) -> Iterator[Actions | Exception]:
+    """Run rpg() on a stream of fields in a pool of processes and yield the
+    results in the order of the fields.
+
+    The fields are sent by chunks, two per process at most at any time: a
+    new chunk is only read from the stream once the oldest one is yielded,
+    so a slow dungeon holds back no more than that many chunks of results.
+    The result of a field is its list of actions, or the exception rpg()
+    raised: TimeoutError if it ran for more than timeout seconds.
+    global_search, weight, max_nodes and macro are passed on to rpg().
+    """
+    processes = processes or os.cpu_count()
+    fields = iter(fields)
+    chunks = iter(lambda: list(islice(fields, chunksize)), [])
+    options = (timeout, global_search, weight, max_nodes, macro)
+
+    with ProcessPoolExecutor(processes) as pool:
+        queue = deque(
+            pool.submit(rpg_chunk, chunk, *options)
+            for chunk in islice(chunks, 2 * processes))
+        while queue:
+            results = queue.popleft().result()
+            chunk = next(chunks, None)
+            if chunk is not None:
+                queue.append(pool.submit(rpg_chunk, chunk, *options))
+            yield from results
+
+
+def rpg_chunk(
+        chunk: list[InitField],
+        timeout: float | None,
+        global_search: bool,
+        weight: float,
+        max_nodes: int | None,
+        macro: bool) -> list[Actions | Exception]:
+    return [
+        rpg_with_timeout(
+            field, timeout, global_search, weight, max_nodes, macro)
+        for field in chunk
+    ]
+
+
+def rpg_with_timeout(
+        field: InitField,
+        timeout: float | None,
+        global_search: bool,
+        weight: float,
+        max_nodes: int | None,
+        macro: bool) -> Actions | Exception:
+    if timeout:
+        signal.signal(signal.SIGALRM, raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return rpg(field, global_search, weight, max_nodes, macro)
+    except Exception as e:
+        return e
+    finally:
+        if timeout:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def raise_timeout(*_) -> None:
+    raise TimeoutError('the dungeon took too long to solve')
+
+
+def generate_dungeon(
+        seed: int,
+        height: int,
+        width: int,
+        walls: float = 0.15,
+        enemies: int = 3,
+        doors: int = 1,
+        merchants: int = 1,
+        shields: int = 2,
+        dual_swords: int = 3,
+        health_kits: int = 3,
+        attempts: int = 1000) -> InitField:
+    """Reproducible random dungeon: a key for each door, the coins for each
+    merchant, and every cell that is not a wall reachable from the player.
+    Raises ValueError if no such layout is found in `attempts` shuffles.
+    """
+    rnd = random.Random(seed)
+    objects = (
+        [DEMON_LORD, rnd.choice(list(Board.MOVES))]
+        + [ENEMY] * enemies
+        + [rnd.choice((DOOR1, DOOR2)) for _ in range(doors)]
+        + [KEY] * (doors * RPGSimulator.KEYS_NEEDED)
+        + [MERCHANT] * merchants
+        + [COIN] * (merchants * RPGSimulator.COINS_NEEDED)
+        + [SHIELD] * shields
+        + [DUAL_SWORDS] * dual_swords
+        + [HEALTH] * health_kits
+    )
+    if len(objects) > height * width:
+        raise ValueError(
+            f'{len(objects)} objects do not fit in a {height}x{width} dungeon')
+
+    points = [Point(x, y) for x in range(height) for y in range(width)]
+    n_walls = min(
+        round(height * width * walls), height * width - len(objects))
+    for _ in range(attempts):
+        rnd.shuffle(points)
+        field = [[EMPTY] * width for _ in range(height)]
+        for x, y in points[:n_walls]:
+            field[x][y] = WALL
+        for (x, y), value in zip(points[n_walls:], objects):
+            field[x][y] = value
+        if is_connected(field):
+            return field
+    raise ValueError(
+        f'no connected {height}x{width} dungeon with {walls:.0%} of walls '
+        f'found in {attempts} attempts')
+
+
+def is_connected(field: InitField) -> bool:
+    board = Board(field=field)
+    seen = {board.player_point}
+    queue = deque(seen)
+    while queue:
+        point = queue.popleft()
+        for n_point in board.find_neighboring_points(point).values():
+            if n_point not in seen:
+                seen.add(n_point)
+                queue.append(n_point)
+    return len(seen) == len(board.valid_points)
+
+
+def benchmark(
+        sizes: Iterable[tuple[int, int]] = ((8, 10), (16, 20), (32, 40)),
+        seeds: Iterable[int] = range(20),
+        walls: float = 0.15,
+        global_search: bool = False,
+        trace: TextIO | None = None,
+        weight: float = 1.0,
+        max_nodes: int | None = PLANNER_MAX_NODES,
+        macro: bool = False) -> Iterator[dict]:
+    """Solve the generated dungeons of each size and yield one record of
+    measures per size. The number of each kind of object grows with the
+    area of the dungeon. With a trace file, the rounds of each dungeon are
+    written there as JSON lines (see SearchStats)."""
+    seeds = list(seeds)
+    for height, width in sizes:
+        scale = max(1, height * width // 80)
+        items = dict(
+            enemies=3 * scale,
+            doors=scale,
+            merchants=scale,
+            shields=2 * scale,
+            dual_swords=3 * scale,
+            health_kits=3 * scale,
+        )
+        wall_time, nodes_expanded, solved, peak_memory = 0.0, 0, 0, 0
+        for seed in seeds:
+            field = generate_dungeon(seed, height, width, walls, **items)
+            start = time.perf_counter()
+            try:
+                _, nodes = solve_dungeon(
+                    deepcopy(field), global_search,
+                    weight=weight, max_nodes=max_nodes, macro=macro)
+                solved += 1
+            except ValueError:
+                nodes = 0
+            wall_time += time.perf_counter() - start
+            nodes_expanded += nodes
+
+            if trace and not global_search:
+                stats = SearchStats(trace=True)
+                try:
+                    solve_dungeon(deepcopy(field), stats=stats)
+                except ValueError:
+                    pass
+                stats.dump_trace(trace, size=[height, width], seed=seed)
+
+            # second run for the memory: tracemalloc slows everything down
+            tracemalloc.start()
+            try:
+                solve_dungeon(
+                    deepcopy(field), global_search,
+                    weight=weight, max_nodes=max_nodes, macro=macro)
+            except ValueError:
+                pass
+            peak_memory = max(peak_memory, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+        yield {
+            'size': [height, width],
+            'dungeons': len(seeds),
+            'global_search': global_search,
+            'weight': weight,
+            'max_nodes': max_nodes,
+            'macro': macro,
+            'wall_time': wall_time,
+            'dungeons_per_second': len(seeds) / wall_time,
+            'solved_ratio': solved / len(seeds),
+            'nodes_expanded': nodes_expanded,
+            'nodes_per_dungeon': nodes_expanded / len(seeds),
+            'peak_memory': peak_memory,
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark rpg() on generated dungeons '
+                    '(one JSON record per line)')
+    parser.add_argument(
+        '--sizes', default='8x10,16x20,32x40',
+        help='comma separated list of HEIGHTxWIDTH')
+    parser.add_argument(
+        '--seeds', default=20, type=int,
+        help='number of dungeons per size')
+    parser.add_argument(
+        '--walls', default=0.15, type=float,
+        help='density of the walls')
+    parser.add_argument(
+        '--global-search', action='store_true',
+        help='plan with StateSpacePlanner instead of RPGSimulator')
+    parser.add_argument(
+        '--weight', default=1.0, type=float,
+        help="StateSpacePlanner's weight: above one, faster and longer plans")
+    parser.add_argument(
+        '--max-nodes', default=PLANNER_MAX_NODES, type=int,
+        help='states StateSpacePlanner may expand before falling back to '
+             'RPGSimulator')
+    parser.add_argument(
+        '--macro', action='store_true',
+        help='let StateSpacePlanner move from object to object')
+    parser.add_argument(
+        '--trace', default=None,
+        help="write the simulator's rounds of every dungeon to this file")
+    parser.add_argument(
+        '--out', default=None,
+        help='output file (default: stdout)')
+    args = parser.parse_args()
+
+    sizes = [
+        tuple(map(int, size.split('x'))) for size in args.sizes.split(',')
+    ]
+    with (
+        open(args.out, 'w') if args.out else nullcontext(sys.stdout) as out,
+        open(args.trace, 'w') if args.trace else nullcontext() as trace,
+    ):
+        for record in benchmark(
+                sizes, range(args.seeds), args.walls, args.global_search,
+                trace, args.weight, args.max_nodes, args.macro):
+            print(json.dumps(record), file=out, flush=True)
@@ -1,172 +1,1049 @@
-from itertools import combinations
+import argparse
+import asyncio
+import io
+import json
+import mmap
+import os
+import random
+import signal
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import lru_cache
+from itertools import islice, product
+from operator import itemgetter
+from math import comb
 
+try:
+    import numpy as np
+except ImportError:                                                         # Optional: without it, complexSearch_OpenAndFlag runs the pairwise search position by position
+    np = None
+
+
+def solve_mine(mapStr, n, oracle=None, stats=None, guess=False, cache=None):   return MineSweeper(mapStr, n, oracle, stats, guess, cache).solve()
+
+async def solve_mine_async(mapStr, n, oracle):
+    """ Solve with an AsyncOracle: the solver runs in a worker thread, each of its rounds of reveals is sent to the event loop at once """
+    bridge = AsyncOracleBridge(oracle, asyncio.get_running_loop())
+    return await asyncio.to_thread(solve_mine, mapStr, n, bridge)
+
+
+def solve_many(jobs, processes=None, chunksize=16, ordered=True, timeout=None):
+    """ Solve a stream of (mapStr, nMines, oracle) jobs in a pool of processes, sending them by chunks.
+        Yields (index, result) in submission order if 'ordered', in completion order otherwise. The result of a job is
+        the solution (or '?'), or the exception it raised: TimeoutError if it ran for more than 'timeout' seconds.
+        In submission order, no new chunk is sent while 4 chunks per process of results wait for an earlier job. """
+    jobs       = enumerate(jobs)
+    processes  = processes or os.cpu_count()
+    maxBuffer  = 4 * processes * chunksize                                  # Results kept waiting for a slow job at the head of the queue
+    pending, results, nextIndex, exhausted = set(), {}, 0, False
+    
+    with ProcessPoolExecutor(processes) as pool:
+        while True:
+            while not exhausted and len(pending) < 2*processes and len(results) < maxBuffer:    # Keep every process busy, without pulling the whole stream at once
+                chunk = list(islice(jobs, chunksize))
+                if chunk: pending.add(pool.submit(solveChunk, chunk, timeout))
+                else:     exhausted = True
+            if not pending: break
+            
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                if not ordered: yield from future.result()
+                else:           results.update(future.result())
+            while nextIndex in results:
+                yield nextIndex, results.pop(nextIndex)
+                nextIndex += 1
+
+def solveChunk(chunk, timeout):       return [ (i, solveWithTimeout(*job, timeout=timeout)) for i,job in chunk ]
+
+def solveWithTimeout(mapStr, n, oracle=None, timeout=None):
+    if timeout:
+        signal.signal(signal.SIGALRM, raiseTimeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:                              return solve_mine(mapStr, n, oracle)
+    except Exception as e:            return e
+    finally:
+        if timeout: signal.setitimer(signal.ITIMER_REAL, 0)
+
+def raiseTimeout(*_):                 raise TimeoutError("The board took too long to solve")
+
+
+
+class MineExploded(Exception): pass
+
+
+class DeductionCache(object):
+    """ Bounded table of deductions (LRU eviction), keyed by canonical encodings of local configurations, so that boards
+        sharing it never derive twice the same conclusions. Can be saved to disk and loaded back, to be reused across runs:
+        the file is plain JSON, so that loading one never runs any code.
+        windows: also cache the deductions of the 5x5 windows (complexSearch_OpenAndFlag). Off by default: finding the canonical
+                 window costs about as much as the deduction itself, so it is only worth it where most windows repeat. """
+    
+    def __init__(self, maxsize=100000, path=None, windows=False):
+        self.table   = OrderedDict()
+        self.maxsize = maxsize
+        self.windows = windows
+        self.hits    = 0
+        self.misses  = 0
+        if path and os.path.exists(path): self.load(path)
+    
+    def __len__(self):                return len(self.table)
+    
+    def get(self, key):
+        value = self.table.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.table.move_to_end(key)
+        return value
+    
+    def put(self, key, value):
+        self.table[key] = value
+        self.table.move_to_end(key)
+        if self.maxsize is not None and len(self.table) > self.maxsize: self.table.popitem(last=False)
+    
+    def save(self, path):
+        with io.open(path, 'w') as f: json.dump([ self.toData(item) for item in self.table.items() ], f)     # io.open: the global "open" may be the game's one
+    
+    def load(self, path):
+        with io.open(path, 'r') as f:
+            for key,value in map(self.fromData, json.load(f)): self.put(key, value)
+    
+    @classmethod
+    def toData(cls, value):
+        """ JSON form of the keys and values: tuples become lists, bytes and dicts (whose keys may not be strings) are tagged """
+        if isinstance(value, bytes):          return {'bytes': value.hex()}
+        if isinstance(value, dict):           return {'dict': [ [cls.toData(k), cls.toData(v)] for k,v in value.items() ]}
+        if isinstance(value, (tuple, list)):  return [ cls.toData(v) for v in value ]
+        return value
+    
+    @classmethod
+    def fromData(cls, data):
+        if isinstance(data, dict):            return bytes.fromhex(data['bytes']) if 'bytes' in data else { cls.fromData(k): cls.fromData(v) for k,v in data['dict'] }
+        if isinstance(data, list):            return tuple( cls.fromData(v) for v in data )
+        return data
+    
+    def asDict(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self.table), 'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits/lookups if lookups else 0}
+
+
+class SolverStats(object):
+    """ Counters of the solver phases, filled by the MineSweeper instances it is given to (one or many boards).
+        'hook', if given, is called with (phase name, record) after each run of a phase. Records hold:
+            iterations:  worklist rounds (openAndFlag_OnTheFly), numbers examined (complexSearch_OpenAndFlag), components solved (complexSearch_CombineApproach, openSafestPos)
+            candidates:  rows derived by the frontier matrix reduction (complexSearch_OpenAndFlag), partial configurations tried
+                         by the backtracking, or by the sampling (complexSearch_CombineApproach, openSafestPos)
+            borderSize:  number of '?' in the components (complexSearch_CombineApproach, openSafestPos)
+            opened, flagged, time """
+    
+    PHASES = ('openAndFlag_OnTheFly', 'complexSearch_OpenAndFlag', 'complexSearch_CombineApproach', 'openSafestPos')
+    FIELDS = ('runs', 'iterations', 'candidates', 'borderSize', 'opened', 'flagged', 'time')
+    
+    def __init__(self, hook=None):
+        self.hook    = hook
+        self.boards  = 0
+        self.phases  = { phase: dict.fromkeys(self.FIELDS, 0) for phase in self.PHASES }
+        self.current = None
+    
+    def start(self, phase):           self.current = dict.fromkeys(self.FIELDS, 0); self.current['runs'] = 1
+    
+    def add(self, field, n=1):        self.current[field] += n
+    
+    def end(self, phase, **measures):
+        self.current.update(measures)
+        totals = self.phases[phase]
+        for field,n in self.current.items(): totals[field] += n
+        if self.hook: self.hook(phase, self.current)
+    
+    def asDict(self):                 return {'boards': self.boards, 'phases': self.phases}
+
+
+class Oracle(object):
+    """ Reveals the cells of a board. Subclasses implement reveal (or reveal_many, to send a whole batch in one round trip).
+        Results are cached: a cell is never revealed twice. """
+    
+    def __init__(self):               self.cache = {}
+    
+    def reveal(self, x, y):           raise NotImplementedError
+    
+    def reveal_many(self, positions): return [ self.reveal(x,y) for x,y in positions ]
+    
+    def open(self, x, y):             return self.open_many([(x,y)])[0]
+    
+    def open_many(self, positions):
+        missing = [ pos for pos in dict.fromkeys(positions) if pos not in self.cache ]
+        if missing: self.cache.update(zip(missing, self.reveal_many(missing)))
+        return [ self.cache[pos] for pos in positions ]
+
+
+class FunctionOracle(Oracle):
+    """ Wraps a plain open(x,y) function. By default, the "open" global of this module, as provided by the game """
+    
+    def __init__(self, function=None):
+        super().__init__()
+        self.function = function
+    
+    def reveal(self, x, y):           return int(self.function(x,y) if self.function else open(x,y))
+
+
+class BoardOracle(Oracle):
+    """ Local stand-in for the game, built from the fully known board ('x' for the mines). Counts the round trips and reveals. """
+    
+    def __init__(self, solution):
+        super().__init__()
+        self.board      = [ line.split(' ') for line in solution.split('\n') ]
+        self.roundTrips = 0
+        self.reveals    = 0
+    
+    def reveal(self, x, y):
+        if self.board[x][y] == 'x': raise MineExploded("Boom! There was a mine at {}".format((x,y)))
+        return int(self.board[x][y])
+    
+    def reveal_many(self, positions):
+        self.roundTrips += 1
+        self.reveals    += len(positions)
+        return [ self.reveal(x,y) for x,y in positions ]
+
+
+class AsyncOracle(object):
+    """ Same as Oracle, with coroutines: the reveals of a batch are issued concurrently """
+    
+    def __init__(self):               self.cache = {}
+    
+    async def reveal(self, x, y):     raise NotImplementedError
+    
+    async def reveal_many(self, positions): return await asyncio.gather(*( self.reveal(x,y) for x,y in positions ))
+    
+    async def open_many(self, positions):
+        missing = [ pos for pos in dict.fromkeys(positions) if pos not in self.cache ]
+        if missing: self.cache.update(zip(missing, await self.reveal_many(missing)))
+        return [ self.cache[pos] for pos in positions ]
+
+
+class AsyncBoardOracle(AsyncOracle):
+    """ Asynchronous BoardOracle, with an optional latency per reveal to mimic a remote game backend.
+        Its board counts one round trip per batch, like BoardOracle: the reveals of a batch run concurrently """
+    
+    def __init__(self, solution, latency=0):
+        super().__init__()
+        self.board   = BoardOracle(solution)
+        self.latency = latency
+    
+    async def reveal(self, x, y):
+        await asyncio.sleep(self.latency)
+        return self.board.reveal(x,y)
+    
+    async def reveal_many(self, positions):
+        self.board.roundTrips += 1
+        self.board.reveals    += len(positions)
+        return await super().reveal_many(positions)
+
+
+class AsyncOracleBridge(Oracle):
+    """ Synchronous face of an AsyncOracle, for a solver running in another thread than the event loop """
+    
+    def __init__(self, oracle, loop):
+        super().__init__()
+        self.oracle, self.loop = oracle, loop
+    
+    def reveal_many(self, positions): return asyncio.run_coroutine_threadsafe(self.oracle.open_many(positions), self.loop).result()
 
-def solve_mine(mapStr, n):   return MineSweeper(mapStr, n).solve()
 
 class MineSweeper(object):
 
     IS_DEBUG = False
-    around   = [ (dx,dy) for dx in range(-1,2) for dy in range(-1,2) if (dx,dy) != (0,0) ]
+    UNKNOWN, FLAG, OUT = 9, 10, 11                                          # Cell codes: 0-8 are the numbers themselves, OUT pads the borders of the grid
+    TO_CODE  = bytes.maketrans(b'012345678?x', bytes(range(11)))
+    TO_CHAR  = bytes.maketrans(bytes(range(11)), b'012345678?x')
+    TO_WINDOW      = bytes( [OUT]*UNKNOWN + [UNKNOWN] + [OUT]*(255-UNKNOWN) )     # Keeps the '?' only
+    WINDOW_CENTER  = (12,) + tuple( (dx+2)*5 + dy+2 for dx in range(-1,2) for dy in range(-1,2) if (dx,dy) != (0,0) )   # pos, then its neighbors in the same order as self.around
+    MAX_CANDIDATES = 50000                                                  # Components whose backtracking tries more partial configurations than that are sampled instead...
+    SAMPLES        = 1000                                                   # ...with that many random walks down their search tree
+    MATRIX_ROUNDS  = 8                                                      # Subset/difference rounds of the frontier matrix reduction: each round may subtract the rows derived by the previous one
     
-    def __init__(self, mapStr, nMines):
-        lines = mapStr.split('\n')
-        mapDct, unknowns, posToWorkOn = {}, set(), set()
-        for x,line in enumerate(lines):
-            for y,c in enumerate(line.split(' ')):
-                mapDct[(x,y)] = c
-                if c == '?': unknowns.add((x,y))
-                else:        posToWorkOn.add((x,y))
-    
-        self.map         = mapDct
-        self.unknowns    = unknowns
-        self.posToWorkOn = posToWorkOn
-        self.flagged     = set()
-        self.nMines      = nMines
-        self.lX          = len(lines)
-        self.lY          = len(lines[0].split(' '))
+    def __init__(self, mapStr, nMines, oracle=None, stats=None, guess=False, cache=None):
+        """ mapStr: the board as a string, or any iterable of its lines as bytes (see fromFile, fromBuffer and fromStream)
+            guess:  when the deductions run out, open the '?' that is the least likely to be a mine and keep going
+            cache:  DeductionCache to reuse the component solutions and, with its 'windows' option, the local deductions (shared between boards) """
+        lines = mapStr.encode().split(b'\n') if isinstance(mapStr, str) else mapStr
+        out   = bytes([self.OUT])
+        cells = bytearray()                                                 # Flat array of cell codes, indexed by pos = (x+1)*width + (y+1)
+        self.lX = 0
+        for line in lines:
+            line = line.rstrip(b'\r\n')
+            if not line: continue
+            if not self.lX:
+                self.lY    = (len(line)+1) // 2                             # Tokens are single chars separated by single spaces
+                self.width = self.lY + 2                                    # One OUT cell on each side, so that neighbors never need bound checks
+                cells     += out * self.width
+            cells  += out + line[0::2].translate(self.TO_CODE) + out
+            self.lX += 1
+        cells += out * self.width
+        
+        self.around         = self.neighborTable(self.width)
+        self.cells          = cells
+        self.nUnknowns      = cells.count(self.UNKNOWN)                     # Cell states live in self.cells only: just keep the counts
+        self.nFlagged       = cells.count(self.FLAG)
+        self.unknownsAround = self.countAround(self.UNKNOWN)                # Per cell counters, kept up to date by openThosePos and flagThosePos (one byte per cell)
+        self.flagsAround    = {}                                            # Flags only ever sit next to the frontier: their counters are kept sparse, pos -> count
+        for pos in self.findAll(self.FLAG):
+            for d in self.around: self.flagsAround[pos+d] = self.flagsAround.get(pos+d, 0) + 1
         
+        isNumber = int.from_bytes(cells.translate(bytes( int(c < 9) for c in range(256) )), 'little')
+        isBorder = int.from_bytes(self.unknownsAround.translate(bytes( int(c > 0) for c in range(256) )), 'little')
+        self.posToWorkOn    = self.positionsOf((isNumber & isBorder).to_bytes(len(cells), 'little'), 1)   # Only the frontier is kept as a set
+        self.dirty          = set(self.posToWorkOn)                         # Numbers whose neighborhood changed since the simple search last looked at them
+        self.complexDirty   = set(self.posToWorkOn)                         # Same thing, for the "complex" search
+        self.nMines         = nMines
+        self.oracle         = oracle or FunctionOracle()
+        self.stats          = stats
+        self.guess          = guess
+        self.deductions     = cache
+        self.componentCache = DeductionCache(maxsize=None)                  # Components solutions of this board only, when no shared cache is given
+        if stats: stats.boards += 1
     
     
-    def __str__(self):                return '\n'.join(' '.join( self.map[(x,y)] for y in range(self.lY)) for x in range(self.lX) )
+    @classmethod
+    def fromStream(cls, stream, nMines, **kwargs):
+        """ Load the board from a binary stream, line by line. kwargs: any other argument of __init__ (oracle, stats, guess, cache) """
+        return cls(stream, nMines, **kwargs)
     
-    def getValAt(self,pos):           return int(self.map[pos])
+    @classmethod
+    def fromBuffer(cls, buffer, nMines, **kwargs):
+        """ Load the board from any bytes-like buffer (bytes, mmap...) without copying it as a whole """
+        def lines():
+            start = 0
+            while start < len(buffer):
+                end = buffer.find(b'\n', start)
+                end = len(buffer) if end == -1 else end
+                yield buffer[start:end]
+                start = end + 1
+        return cls(lines(), nMines, **kwargs)
     
-    def getneighbors(self, pos):      return { (pos[0]+dx,pos[1]+dy) for dx,dy in self.around }
+    @classmethod
+    def fromFile(cls, path, nMines, **kwargs):
+        """ Load the board from a file, memory-mapped """
+        with io.open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:    # io.open: the global "open" may be the game's one
+            return cls.fromBuffer(buffer, nMines, **kwargs)
     
-    def printDebug(self):             print(" \n------------\n{}\nRemaining mines: {}".format(self, self.nMines-len(self.flagged))) if self.IS_DEBUG else None
     
-    def lookaroundThisPos(self, pos):
-        neighbors = self.getneighbors(pos)
-        return {'?': neighbors & self.unknowns,
-                'x': neighbors & self.flagged}
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def neighborTable(width):                                               # Offsets of the 8 neighbors in the flat array, shared by all the boards of the same width
+        return tuple( dx*width + dy for dx in range(-1,2) for dy in range(-1,2) if (dx,dy) != (0,0) )
+    
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def pairTable(width):
+        """ For each neighbor d of a position: the offsets, relative to that position, of the cells around both of them,
+            around the position only, and around the neighbor only (neither of the two numbers themselves) """
+        around = set(MineSweeper.neighborTable(width))
+        return tuple( (d, tuple(sorted( around & {d+e for e in around} )),
+                          tuple(sorted( around - {d+e for e in around} - {d} )),
+                          tuple(sorted( {d+e for e in around} - around - {0} )))
+                      for d in MineSweeper.neighborTable(width) )
+    
+    def countAround(self, code):
+        """ Number of neighbors holding 'code', for all the cells at once. Works on the whole array as one big integer:
+            each byte is a 0/1 flag, and the sum of 8 of them can never carry over to the next byte. """
+        isCode = int.from_bytes(self.cells.translate(bytes( int(c == code) for c in range(256) )), 'little')
+        total  = sum( isCode >> 8*d if d > 0 else isCode << -8*d for d in self.around )
+        size   = len(self.cells)
+        return bytearray( (total & ((1 << 8*size) - 1)).to_bytes(size, 'little') )
+    
+    def findAll(self, code):          return self.positionsOf(self.cells, code)
+    
+    @staticmethod
+    def positionsOf(array, code):
+        found, target = set(), bytes([code])
+        pos = array.find(target)
+        while pos != -1:
+            found.add(pos)
+            pos = array.find(target, pos+1)
+        return found
+    
+    def __str__(self):                return b'\n'.join(self.iterLines()).decode()
+    
+    def iterLines(self):
+        row = bytearray(b' ' * (2*self.lY-1))
+        for x in range(self.lX):
+            start = self.toPos(x, 0)
+            row[0::2] = self.cells[start:start+self.lY].translate(self.TO_CHAR)
+            yield bytes(row)
+    
+    def writeTo(self, stream):
+        for x,line in enumerate(self.iterLines()):
+            stream.write(b'\n' + line if x else line)
+    
+    def toPos(self, x, y):            return (x+1)*self.width + y+1
+    
+    def toCoords(self, pos):          return tuple( v-1 for v in divmod(pos, self.width) )
+    
+    def getValAt(self,pos):           return self.cells[pos]
+    
+    def getMinesLeft(self,pos):       return self.cells[pos] - self.flagsAround.get(pos, 0)
+    
+    def runPhase(self, phase):
+        if not self.stats: return phase()                                   # No instrumentation: no overhead
+        
+        nUnknowns, nFlagged = self.nUnknowns, self.nFlagged
+        self.stats.start(phase.__name__)
+        start = time.perf_counter()
+        try:
+            phase()
+        finally:                                                            # A guess may blow up: its record still has to be closed
+            flagged = self.nFlagged - nFlagged
+            self.stats.end(phase.__name__, time=time.perf_counter()-start, opened=nUnknowns-self.nUnknowns-flagged, flagged=flagged)
+    
+    def printDebug(self):             print(" \n------------\n{}\nRemaining mines: {}".format(self, self.nMines-self.nFlagged)) if self.IS_DEBUG else None
+    
+    def unknownsOf(self, pos, offsets=None):
+        """ The '?' among the cells at these offsets of pos (by default, around it) """
+        cells, UNKNOWN = self.cells, self.UNKNOWN
+        return [ pos+d for d in (self.around if offsets is None else offsets) if cells[pos+d] == UNKNOWN ]
         
     
     """ MAIN FUNCTION """
-    def solve(self):
+    def solve(self, out=None):
+        """ Returns '?' if the board cannot be solved. Otherwise, returns the solved board as a string or,
+            if 'out' (a binary stream) is given, streams it there and returns 'out' """
         
         self.printDebug()
         while True:
-            while True:
-                archivePosToWorkOn = self.posToWorkOn.copy()            # Archive to check against modifications
-                
-                self.openAndFlag_OnTheFly();       self.printDebug()    # Open and flag in the map while simple matches can be found
-                self.complexSearch_OpenAndFlag();  self.printDebug()    # Use more complex algorithm to find mines or unknown positions that are surely openable
-                
-                if archivePosToWorkOn == self.posToWorkOn: break        # Repeat these two "simple" steps until its not possible to go further in the resolution
+            while self.dirty or self.complexDirty:                      # Repeat these two "simple" steps until no neighborhood changed anymore
+                self.runPhase(self.openAndFlag_OnTheFly);       self.printDebug()   # Open and flag in the map while simple matches can be found
+                self.runPhase(self.complexSearch_OpenAndFlag);  self.printDebug()   # Use more complex algorithm to find mines or unknown positions that are surely openable
+            
+            self.runPhase(self.complexSearch_CombineApproach)           # Use witted combinatory approach to go further (if possible)
             
-            self.complexSearch_CombineApproach()                        # Use witted combinatory approach to go further (if possible)
+            if not self.dirty and self.guess and self.nUnknowns:        # Stuck: gamble on the safest position, if allowed to
+                try:                  self.runPhase(self.openSafestPos)
+                except MineExploded:  return '?'
             
-            if archivePosToWorkOn == self.posToWorkOn:
-                break; self.printDebug()                                # Repeat these to "simple" steps until its not possible to go further in the resolution
+            if not self.dirty: break                                    # Nothing changed: not possible to go further in the resolution
+            self.printDebug()
         
         
-        if len(self.flagged) == self.nMines:                            # If no more mines remaining but some unknown cases still there
-            self.openThosePos(self.unknowns.copy())
+        if self.nFlagged == self.nMines:                                # If no more mines remaining but some unknown cases still there
+            self.openThosePos(self.findAll(self.UNKNOWN))
             
-        elif len(self.flagged) + len(self.unknowns) == self.nMines:     # If all the remaining "?" are mines, flag them
-            self.flagThosePos(self.unknowns.copy())
+        elif self.nFlagged + self.nUnknowns == self.nMines:             # If all the remaining "?" are mines, flag them
+            self.flagThosePos(self.findAll(self.UNKNOWN))
         
         self.printDebug()
         
-        return '?' if self.unknowns else str(self)
+        if self.nUnknowns: return '?'
+        if out is None:    return str(self)
+        self.writeTo(out)
+        return out
         
     
     def openAndFlag_OnTheFly(self):
-        while True:
-            openables, workDonePos = set(), set()
-            for pos in self.posToWorkOn:                                    # Run through all the positions that might neighbors to open
-                openables, workDonePos = [ baseSet|newPart for baseSet,newPart in zip((openables, workDonePos), self.openablePosaround_FlagOnTheFly(pos)) ]
-            
-            self.openThosePos(openables)                                    # After the exit of the loop, modification of self.posToWorkOn is possible, so:
-            self.posToWorkOn -= workDonePos                                 # remove the pos with full number of mines from the working set (to fasten the executions)
-            if not openables and not workDonePos: break     
+        while self.dirty:
+            workList, self.dirty = self.dirty, set()                        # Only the numbers whose neighborhood changed can give something new
+            if self.stats: self.stats.add('iterations')
+            openables = set()
+            for pos in workList & self.posToWorkOn:
+                openables.update(self.openablePosaround_FlagOnTheFly(pos))
+            self.openThosePos(openables)                                    # Opening them may dirty some other numbers: loop again
     
     
     def openablePosaround_FlagOnTheFly(self, pos):
-        around = self.lookaroundThisPos(pos)
+        minesLeft = self.getMinesLeft(pos)
         
-        if self.getValAt(pos) == len(around['?']) + len(around['x']):       # If all the unknomn cases can be flagged (or if they are already!)...
-            self.flagThosePos(around['?'])                                  # flag them (if not already done)
-            return (set(), {pos})                                           # return the current position to remove it from self.posToWorkOn ("We're done with you..." / This behaviour will identify the "done" positions generated by the "witted approach")
+        if minesLeft == self.unknownsAround[pos]:                           # If all the unknomn cases can be flagged...
+            self.flagThosePos(self.unknownsOf(pos))                         # flag them (this also removes the current position from self.posToWorkOn: "We're done with you...")
+            return ()
             
-        return (around['?'], {pos}) if self.getValAt(pos) == len(around['x']) else (set(), set())  
+        return self.unknownsOf(pos) if minesLeft == 0 else ()
         
         
     def openThosePos(self, posToOpen):
-        for pos in posToOpen:
-            self.map[pos] = str(open(*pos))                                 # Open squares and update the map
-            if self.map[pos] != '0': self.posToWorkOn.add(pos)              # Update slef.posToWorkOn if needed
-        self.unknowns -= posToOpen                                          # Remove opened squares from the unknown positions
+        posToOpen = [ pos for pos in posToOpen if self.cells[pos] == self.UNKNOWN ]
+        if not posToOpen: return
+        values    = self.oracle.open_many([ self.toCoords(pos) for pos in posToOpen ])  # All these reveals are independent: one single batch
+        
+        for pos,value in zip(posToOpen, values):
+            self.cells[pos] = int(value)                                    # Open squares and update the map
+            self.nUnknowns -= 1                                             # Update the number of unknown positions
+            self.updateAround(pos, isFlag=False)
+            if self.unknownsAround[pos]:                                    # Update self.posToWorkOn if needed
+                self.posToWorkOn.add(pos)
+                self.dirty.add(pos)
+                self.complexDirty.add(pos)
     
     
     def flagThosePos(self, posToFlag):
-        for pos in posToFlag: self.map[pos] = 'x'                           # Flag mines
-        self.unknowns -= posToFlag                                          # Remove flagged squares from the unknown positions
-        self.flagged  |= posToFlag                                          # update the set of flagged positions
+        for pos in posToFlag:
+            if self.cells[pos] != self.UNKNOWN: continue
+            self.cells[pos] = self.FLAG                                     # Flag mines
+            self.nUnknowns -= 1                                             # update the counts of unknown and flagged positions
+            self.nFlagged  += 1
+            self.updateAround(pos, isFlag=True)
+    
+    
+    def updateAround(self, pos, isFlag):
+        for d in self.around:                                               # One '?' less around each neighbor...
+            pos2 = pos + d
+            self.unknownsAround[pos2] -= 1
+            if isFlag: self.flagsAround[pos2] = self.flagsAround.get(pos2, 0) + 1
+            if pos2 in self.posToWorkOn:                                    # ...so the neighbors that are numbers have to be looked at again
+                self.dirty.add(pos2)
+                self.complexDirty.add(pos2)
+                if not self.unknownsAround[pos2]: self.posToWorkOn.discard(pos2)
     
     
     def complexSearch_OpenAndFlag(self):
-        markables, openables = set(), set()
-        for pos in self.posToWorkOn:
-            newMark, newOpen = self.intelligencia_OpenAndFlag(pos)
-            markables |= newMark
-            openables |= newOpen
+        changed, self.complexDirty = self.complexDirty, set()
+        if np is not None and (self.deductions is None or not self.deductions.windows):
+            markables, openables = self.frontierMatrix_OpenAndFlag(changed)
+        else:
+            workList = { pos+d for pos in changed for d in self.around } | changed     # Deductions depend on the cells up to 2 steps away: work on the changed numbers and their neighbors
+            workList &= self.posToWorkOn
+            if self.stats: self.stats.add('iterations', len(workList))
+            
+            markables, openables = set(), set()
+            intelligencia = self.intelligencia_Cached if self.deductions is not None and self.deductions.windows else self.intelligencia_OpenAndFlag
+            for pos in workList:
+                newMark, newOpen = intelligencia(pos)
+                markables |= newMark
+                openables |= newOpen
             
         self.flagThosePos(markables)
         self.openThosePos(openables)
         
-                
-    def intelligencia_OpenAndFlag(self, pos):
-        around       = self.lookaroundThisPos(pos)                          # Cases around the current position
-        rMines        = [self.getValAt(pos)-len(around['x']), 0]            # Prepare an array with the number of remaining mines to find for the current position and the neighbor that will be worked on later
-        neighToWorkOn = self.getneighbors(pos) & self.posToWorkOn           # Search for neighbors (only usefull ones, meaning: self.getValAt(posneighbor) is a number and this neighbor still miss some mines)
+    
+    def frontierMatrix_OpenAndFlag(self, changed):
+        """ Builds the frontier as a sparse 0/1 matrix, one row per number and one column per '?' around them, with the mines
+            each number still misses as right-hand side, and reduces it (see reduceMatrix). Only the numbers up to 2 steps away
+            from the changed ones are taken: the others share no '?' with them, and were already reduced before """
+        cells  = np.frombuffer(self.cells, dtype=np.uint8)
+        front  = (cells < 9) & (np.frombuffer(self.unknownsAround, dtype=np.uint8) > 0)
+        nums   = np.fromiter(changed, dtype=np.int64, count=len(changed))
+        near   = np.zeros(len(cells), dtype=bool)                                   # Masks over the whole board give sorted positions without any sort
+        near[np.clip(nums[:,None] + self.windowOffsets(self.width), 0, len(cells)-1)] = True     # Clipped positions fall on the OUT borders
+        nums   = np.flatnonzero(near & front)
+        if not len(nums): return set(), set()
+        
+        around = nums[:,None] + np.array(self.around, dtype=np.int64)               # (numbers, 8) positions of the neighbors
+        isUnk  = cells[around] == self.UNKNOWN
+        rows   = np.nonzero(isUnk)[0]                                               # Row-major, and the offsets of self.around go up: sorted by row, then column
+        isCol  = np.zeros(len(cells), dtype=bool)
+        isCol[around[isUnk]] = True
+        colPos = np.flatnonzero(isCol)                                              # Column index -> position of its '?'
+        cols   = (np.cumsum(isCol) - 1)[around[isUnk]]
+        flags  = np.fromiter(( self.flagsAround.get(pos, 0) for pos in nums.tolist() ), dtype=np.int64, count=len(nums))
+        b      = cells[nums].astype(np.int64) - flags
+        
+        isSafe, isMine, nRows = self.reduceMatrix(rows, cols, b, len(colPos), self.MATRIX_ROUNDS)
+        if self.stats:
+            self.stats.add('iterations', len(nums))
+            self.stats.add('candidates', nRows - len(nums))
+        
+        keep = isSafe != isMine                                                     # A '?' in both would mean an inconsistent board: leave it alone
+        if keep.any(): self.complexDirty.update(nums.tolist())                      # The reduction stopped at its first finds: go on with these numbers next time
+        return set(colPos[keep & isMine].tolist()), set(colPos[keep & isSafe].tolist())
+    
+    
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def windowOffsets(width):         return np.array([ dx*width + dy for dx in range(-2,3) for dy in range(-2,3) ], dtype=np.int64)   # The 5x5 window around a position
+    
+    
+    @staticmethod
+    def reduceMatrix(rows, cols, b, nCols, rounds):
+        """ Deductions from the constraints "sum of the columns of row i == b[i]", given as COO entries sorted by row, then column.
+            Each round works on the pairs of rows sharing some columns (sparse A.A^T), at least one of them new:
+             - a row with b == 0 is all safe, a row with b == its size is all mines;
+             - the mines in the c common columns of rows i and j are within lo = max(0, b_i-onlyI, b_j-onlyJ)
+               and hi = min(c, b_i, b_j): the common part is safe if hi == 0, all mines if lo == c, and the columns of
+               i only hold between b_i-hi and b_i-lo mines (all safe, or all mines, at the bounds);
+             - if row j is a strict subset of row i, the difference i-j is a new row, with b_i-b_j mines.
+            The rounds stop at the first one that finds something.
+            Returns the isSafe and isMine masks of the columns, and the final number of rows """
+        def isIn(sortedKeys, keys):
+            if not len(sortedKeys): return np.zeros(len(keys), dtype=bool)
+            return sortedKeys[np.minimum(np.searchsorted(sortedKeys, keys), len(sortedKeys)-1)] == keys
+        
+        size   = np.bincount(rows, minlength=len(b))
+        weight = np.arange(1, nCols+1, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15)          # Row hashes (sums of mixed column indices), to drop the derived rows that are already there
+        weight ^= weight >> np.uint64(31)
+        weight *= np.uint64(0xBF58476D1CE4E5B9)
+        known  = np.sort(np.add.reduceat(weight[cols], np.cumsum(size) - size)) if len(cols) else weight[:0]   # Rows are contiguous, none of them empty
+        isSafe = np.zeros(nCols, dtype=bool)
+        isMine = np.zeros(nCols, dtype=bool)
+        fresh  = 0                                                                  # Rows from that index on are new
+        
+        for _ in range(rounds):
+            nRows = len(b)
+            isSafe[cols[b[rows] == 0]]          = True
+            isMine[cols[b[rows] == size[rows]]] = True
+            
+            order  = np.argsort(cols, kind='stable')                                # Entries grouped by column: each entry meets all the others of its group
+            r, c   = rows[order], cols[order]
+            gStart = np.flatnonzero(np.concatenate([[True], c[1:] != c[:-1]]))
+            gSize  = np.diff(np.append(gStart, len(c)))
+            k      = np.repeat(gSize, gSize)
+            e      = np.repeat(np.arange(len(c)), k)
+            o      = np.repeat(np.repeat(gStart, gSize) - np.cumsum(k) + k, k) + np.arange(len(e))
+            keep   = (e != o) & ((r[e] >= fresh) | (r[o] >= fresh))                 # (i, j, column) for each column common to rows i and j, one of them new
+            ti, tj, tc = r[e][keep], r[o][keep], c[e][keep]
+            if not len(ti): break
+            
+            pairs, inPair, common = np.unique(ti*nRows + tj, return_inverse=True, return_counts=True)
+            pi, pj = np.divmod(pairs, nRows)
+            onlyI  = size[pi] - common
+            onlyJ  = size[pj] - common
+            lo     = np.maximum(0, np.maximum(b[pi]-onlyI, b[pj]-onlyJ))
+            hi     = np.minimum(common, np.minimum(b[pi], b[pj]))
+            isSafe[tc[(hi == 0)[inPair]]]      = True
+            isMine[tc[(lo == common)[inPair]]] = True
+            
+            onlySafe = (onlyI > 0) & (b[pi]-lo == 0)                                # (i, j) and (j, i) are both there: the columns of j only are seen from (j, i)
+            onlyMine = (onlyI > 0) & (b[pi]-hi == onlyI)
+            derive   = (onlyI > 0) & (onlyJ == 0)
+            picked   = np.nonzero(onlySafe | onlyMine | derive)[0]
+            if not len(picked): break
+            
+            lens   = size[pi[picked]]                                               # Columns of row i, for each picked pair: rows are contiguous in the entries
+            starts = (np.cumsum(size) - size)[pi[picked]]
+            ePair  = np.repeat(picked, lens)
+            eCol   = cols[np.repeat(starts - np.cumsum(lens) + lens, lens) + np.arange(lens.sum())]
+            isOnly = ~isIn(rows*nCols + cols, pj[ePair]*nCols + eCol)               # Not a column of row j
+            isSafe[eCol[isOnly & onlySafe[ePair]]] = True
+            isMine[eCol[isOnly & onlyMine[ePair]]] = True
+            if isSafe.any() or isMine.any(): return isSafe, isMine, len(b)      # Found something: the next call goes on from the board it gives
             
-        markables, openables = set(), set()                                 # markables: position that will be flagged / openables: positions that will be open... of course... / fullUnion: stroe all the squares
+            isNew  = isOnly & derive[ePair]
+            dPair, dCol = ePair[isNew], eCol[isNew]                                 # Still sorted by pair, then column
+            if not len(dPair): break
+            dStarts = np.flatnonzero(np.concatenate([[True], dPair[1:] != dPair[:-1]]))
+            hashes  = np.add.reduceat(weight[dCol], dStarts)
+            first   = np.unique(hashes, return_index=True)[1]
+            first   = np.sort(first[~isIn(known, hashes[first])])
+            if not len(first): break
+            
+            newRow  = np.full(len(dStarts), -1)
+            newRow[first] = nRows + np.arange(len(first))
+            eRow    = newRow[np.cumsum(np.concatenate([[True], dPair[1:] != dPair[:-1]])) - 1]
+            keep    = eRow >= 0
+            fresh   = nRows
+            rows    = np.concatenate([rows, eRow[keep]])                            # New rows in order, their columns sorted: the entries stay sorted
+            cols    = np.concatenate([cols, dCol[keep]])
+            b       = np.concatenate([b, (b[pi] - b[pj])[dPair[dStarts[first]]]])
+            known   = np.sort(np.concatenate([known, hashes[first]]))
+            size    = np.bincount(rows, minlength=len(b))
+        
+        isSafe[cols[b[rows] == 0]]          = True                                  # The rows derived by the last round
+        isMine[cols[b[rows] == size[rows]]] = True
+        return isSafe, isMine, len(b)
+    
+    
+    def intelligencia_OpenAndFlag(self, pos):
+        """ Pairwise deductions between pos and each of its neighbors in posToWorkOn. The counters give the sizes of the '?'
+            parts of each pair: the '?' themselves are only listed once a deduction needs them """
+        cells, UNKNOWN = self.cells, self.UNKNOWN
+        rMines        = [self.getMinesLeft(pos), 0]                         # Prepare an array with the number of remaining mines to find for the current position and the neighbor that will be worked on later
+        markables, openables = set(), set()                                 # markables: position that will be flagged / openables: positions that will be open... of course...
         knownParts = []                                                     # knownParts: list of the intersections of the '?' cases of all the neighbors of the current pos and the current neighbor
         
-        for pos2 in neighToWorkOn:
-            around2  = self.lookaroundThisPos(pos2)                                         # Cases around the neighbor that is worked on right now
-            rMines[1] = self.getValAt(pos2) - len(around2['x'])                             # Update the number of mines still to find for the current neighbor
-            onlys     = [ around['?'] - around2['?'], around2['?'] - around['?'] ]          # Define the '?' that are owned only by the current "pos", and only by the current neighbor ("pos2")
-            mInter    = max( n-len(only) for n,only in zip(rMines, onlys) )                 # Define the minimum (yes "minimum", even if "max" is used!) number of mines that have to be in the '?' that are commun to "pos" and it's current neighbor pos2"
+        for d,common,only1,only2 in self.pairTable(self.width):             # Only usefull neighbors: numbers that still miss some mines
+            pos2 = pos + d
+            if pos2 not in self.posToWorkOn: continue
+            rMines[1] = self.getMinesLeft(pos2)                                             # Update the number of mines still to find for the current neighbor
+            if 1 not in rMines: continue                                                    # Nothing "extrapolable" at the current position
             
-            if mInter <= 0 or 1 not in rMines: continue                                     # If these conditions are met, there is nothing "extrapolable" at the current position, so continue the iteration
+            currentIntersect = [ pos+e for e in common if cells[pos+e] == UNKNOWN ]         # '?' around both "pos" and "pos2"
+            nOnlys    = [ self.unknownsAround[pos] - len(currentIntersect),                 # Number of '?' owned only by the current "pos", and only by the current neighbor ("pos2")
+                          self.unknownsAround[pos2] - len(currentIntersect) ]
+            mInter    = max( n-nOnly for n,nOnly in zip(rMines, nOnlys) )                   # Define the minimum (yes "minimum", even if "max" is used!) number of mines that have to be in the '?' that are commun to "pos" and it's current neighbor pos2"
+            if mInter <= 0: continue
             
-            currentIntersect = around['?'] & around2['?']
             if currentIntersect: knownParts.append(currentIntersect)                        # Store (if it exists) the current intersection of '?' cases for further checks
-
-            for i in range(2):                                                              # Work on the two current LOCATIONS (pos, pos2)
-                if len(onlys[i]) == rMines[i]-mInter:  markables |= onlys[i]                # The number of '?' cases that are only around the treated LOCATION matches the number mines of this LOCATION that are out of the interesction "pos & pos2". So, those cases will be flagged
-                elif mInter == rMines[i]:              openables |= onlys[i]                # If the number of mines surely present in the intersection "pos & pos2" matches the number of mines still to found arorund the treated LOCATION, all the cases out of the intersection for the current LOCATION can be opened
+            
+            for i,only in enumerate((only1, only2)):                                        # Work on the two current LOCATIONS (pos, pos2)
+                if nOnlys[i] == rMines[i]-mInter:  markables.update(self.unknownsOf(pos, only))   # The number of '?' cases that are only around the treated LOCATION matches the number mines of this LOCATION that are out of the interesction "pos & pos2". So, those cases will be flagged
+                elif mInter == rMines[i]:          openables.update(self.unknownsOf(pos, only))   # If the number of mines surely present in the intersection "pos & pos2" matches the number of mines still to found arorund the treated LOCATION, all the cases out of the intersection for the current LOCATION can be opened
             
         # Final check on the different intersections parts:
-        fullIntersection = {posInter for posSet in knownParts for posInter in posSet}       # Union of all the intersections for the current position and its differente neighbors
-        if len(knownParts) == rMines[0] and sum( len(s) for s in knownParts) == len(fullIntersection): 
-            openables |= around['?'] - fullIntersection                                     # If some '?' cases are still unchecked while we can be sure that all the remaining mines are elsewhere (even without knowing their exact location), the leftovers can be opened
+        if len(knownParts) == rMines[0]:
+            fullIntersection = { posInter for part in knownParts for posInter in part }    # Union of all the intersections for the current position and its differente neighbors
+            if sum(map(len, knownParts)) == len(fullIntersection):
+                openables.update( pos2 for pos2 in self.unknownsOf(pos) if pos2 not in fullIntersection )   # If some '?' cases are still unchecked while we can be sure that all the remaining mines are elsewhere (even without knowing their exact location), the leftovers can be opened
         
         return markables, openables
         
         
         
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def windowSymmetries():
+        """ The 8 symmetries of the 5x5 window around a position, as index permutations (canonical index -> window index) """
+        perms = []
+        for flip in range(2):
+            for rot in range(4):
+                perm = []
+                for i,j in ( divmod(k, 5) for k in range(25) ):
+                    if flip: i, j = j, i
+                    for _ in range(rot): i, j = j, 4-i
+                    perm.append(i*5 + j)
+                perms.append((itemgetter(*perm), perm))
+        return perms
+    
+    
+    def window(self, pos):
+        """ The 5x5 window around pos, reduced to what intelligencia_OpenAndFlag(pos) depends on: where the '?' are and, for
+            pos and its neighbors in posToWorkOn, the number of mines left. Every other cell is just OUT.
+            Columns out of the board fall on the OUT borders of the flat array; whole rows out of it are filled with OUT. """
+        rows = []
+        for dx in range(-2,3):
+            start = pos + dx*self.width - 2
+            rows.append(self.cells[start:start+5] if 0 <= start and start+5 <= len(self.cells) else bytes([self.OUT])*5)
+        
+        window = bytearray(b''.join(rows).translate(self.TO_WINDOW))
+        for k,d in zip(self.WINDOW_CENTER, (0,) + self.around):
+            if pos+d in self.posToWorkOn: window[k] = self.getMinesLeft(pos+d)
+        return window
+    
+    
+    def intelligencia_Cached(self, pos):
+        """ intelligencia_OpenAndFlag, looked up in the DeductionCache first. The key is the window around pos, in its
+            smallest form over the 8 symmetries; the deductions are stored as indices of that canonical window. """
+        window   = self.window(pos)
+        key,perm = min( (getter(window), perm) for getter,perm in self.windowSymmetries() )
+        key      = ('window', bytes(key))
+        cached   = self.deductions.get(key)
+        
+        if cached is None:
+            markables, openables = self.intelligencia_OpenAndFlag(pos)
+            inverse  = { k:c for c,k in enumerate(perm) }
+            toCanon  = lambda cells: tuple( inverse[dx*5 + dy] for dx,dy in ( divmod(pos2-pos + 2*self.width+2, self.width) for pos2 in cells ) )
+            self.deductions.put(key, (toCanon(markables), toCanon(openables)))
+            return markables, openables
+        
+        toPos = lambda canons: { pos + (k//5-2)*self.width + k%5-2 for k in map(perm.__getitem__, canons) }
+        return toPos(cached[0]), toPos(cached[1])
+    
+    
     def complexSearch_CombineApproach(self):
-        rMines = self.nMines - len(self.flagged)                                            # number of remaining mines to find
-        matchPos = []
+        rMines, components, nOthers, solutions, exact = self.frontierSolutions()
+        counts = [ set(sol) if isExact else set(range(len(cells)+1)) for (cells,_),sol,isExact in zip(components, solutions, exact) ]   # sampled components may hold any number of mines
+        feasibles, restCounts = self.feasibleMineCounts(counts, rMines, nOthers)
+        
+        markables, openables = set(), set()
+        for (cells,_), sol, ks, isExact in zip(components, solutions, feasibles, exact):
+            if not ks or not isExact: continue                                              # samples prove nothing
+            for i,pos in enumerate(cells):
+                if   all( sol[k][1][i] == 0         for k in ks ): openables.add(pos)           # never a mine in any valid configuration
+                elif all( sol[k][1][i] == sol[k][0] for k in ks ): markables.add(pos)           # a mine in every valid configuration
+        
+        if nOthers and restCounts and (max(restCounts) == 0 or min(restCounts) == nOthers):
+            others = self.findAll(self.UNKNOWN) - {pos for cells,_ in components for pos in cells}
+            if max(restCounts) == 0:  openables |= others                                   # the frontier always eats all the remaining mines
+            else:                     markables |= others                                   # the frontier always leaves enough mines to fill all the others
+        
+        self.flagThosePos(markables)
+        self.openThosePos(openables)
+    
+    
+    def frontierSolutions(self):
+        rMines     = self.nMines - self.nFlagged                                            # number of remaining mines to find
+        components = self.frontierComponents()                                              # independent groups of '?' linked by the numbers around them
+        nOthers    = self.nUnknowns - sum( len(cells) for cells,_ in components )           # '?' that no number is constraining
+        if self.stats:
+            self.stats.add('iterations', len(components))
+            self.stats.add('borderSize', self.nUnknowns - nOthers)
+        
+        solved     = [ self.solveComponentCached(cells, constraints, rMines) for cells,constraints in components ]
+        solutions, exact = zip(*solved) if solved else ((), ())
+        return rMines, components, nOthers, solutions, exact
+    
+    
+    def openSafestPos(self):
+        probabilities, pOthers = self.mineProbabilities()
+        if not probabilities and pOthers is None: return
         
-        if rMines != 0:
+        pos = min(probabilities, key=lambda pos: (probabilities[pos], pos), default=None)
+        if pos is None or pOthers is not None and pOthers < probabilities[pos]:             # Better odds away from the frontier: take the first unconstrained '?'
+            pos = self.cells.find(self.UNKNOWN)
+            while pos in probabilities: pos = self.cells.find(self.UNKNOWN, pos+1)
+        self.openThosePos({pos})
+    
+    
+    def mineProbabilities(self):
+        """ Probability to be a mine of each '?' of the frontier, and of any of the other '?' (None if there is none).
+            Each configuration of a component is weighted by the number of configurations of the other components and
+            by the number of ways to spread the remaining mines over the unconstrained '?' """
+        rMines, components, nOthers, solutions, _ = self.frontierSolutions()
+        
+        def convolve(a, b):
+            c = {}
+            for ka,wa in a.items():
+                for kb,wb in b.items():
+                    if ka+kb <= rMines: c[ka+kb] = c.get(ka+kb, 0) + wa*wb
+            return c
+        
+        weights = [ { k:count for k,(count,_) in sol.items() } for sol in solutions ]
+        prefix  = [{0:1}]
+        for w in weights:           prefix.append(convolve(prefix[-1], w))
+        suffix  = [{0:1}]
+        for w in reversed(weights): suffix.append(convolve(suffix[-1], w))
+        suffix.reverse()
+        
+        ways  = lambda rest: comb(nOthers, rest) if 0 <= rest <= nOthers else 0
+        total = sum( w * ways(rMines-s) for s,w in prefix[-1].items() )
+        if not total: return {}, None
+        
+        probabilities = {}
+        for i,((cells,_),sol) in enumerate(zip(components, solutions)):
+            elsewhere = convolve(prefix[i], suffix[i+1])
+            fill      = { k: sum( w * ways(rMines-k-s) for s,w in elsewhere.items() ) for k in sol }
+            for j,pos in enumerate(cells):
+                probabilities[pos] = sum( perCell[j] * fill[k] for k,(_,perCell) in sol.items() ) / total
+        
+        pOthers = sum( w * ways(rMines-s) * (rMines-s) for s,w in prefix[-1].items() ) / (nOthers*total) if nOthers else None
+        return probabilities, pOthers
+    
+    
+    def frontierComponents(self):
+        constraints = {}                                                                    # number position -> '?' around it
+        for pos in self.posToWorkOn:
+            if self.unknownsAround[pos]: constraints[pos] = self.unknownsOf(pos)
+        
+        byUnknown = {}                                                                      # '?' position -> numbers constraining it
+        for pos,unknowns in constraints.items():
+            for pos2 in unknowns: byUnknown.setdefault(pos2, []).append(pos)
+        
+        components, seen = [], set()
+        for root in byUnknown:
+            if root in seen: continue
+            seen.add(root)
+            cells, nums, queue = [], set(), [root]                                          # BFS order keeps the constraints of a component "closing" early during the backtracking
+            while queue:
+                pos2 = queue.pop(0)
+                cells.append(pos2)
+                for pos in byUnknown[pos2]:
+                    if pos in nums: continue
+                    nums.add(pos)
+                    for pos3 in constraints[pos]:
+                        if pos3 not in seen: seen.add(pos3); queue.append(pos3)
+            
+            index = {pos2:i for i,pos2 in enumerate(cells)}
+            components.append((cells, [ (self.getMinesLeft(pos), [index[pos2] for pos2 in constraints[pos]])
+                                        for pos in nums ]))
+        return components
+    
+    
+    def solveComponentCached(self, cells, constraints, maxMines):
+        """ solveComponent, memoized on the structure of the component: its cells numbered in reading order, and the needs and
+            cells of its numbers. That does not depend on where the component is: after a move, only the components that changed
+            are solved again and, with a shared DeductionCache, components already met on other boards are not solved at all.
+            Returns the solutions and whether they are exact (False: sampled, see sampleComponent) """
+        order  = sorted(range(len(cells)), key=cells.__getitem__)
+        rank   = { i:r for r,i in enumerate(order) }
+        key    = ('component', tuple(sorted( (n, tuple(sorted( rank[i] for i in idxs ))) for n,idxs in constraints )))
+        table  = self.deductions if self.deductions is not None else self.componentCache
+        cached = table.get(key)
+        if not cached or cached[0] < maxMines:
+            result = self.solveComponent(cells, constraints, maxMines)
+            exact  = result is not None
+            if not exact: result = self.sampleComponent(cells, constraints, maxMines)
+            cached = (maxMines, { k: (count, tuple( perCell[i] for i in order )) for k,(count,perCell) in result.items() }, exact)
+            table.put(key, cached)
+        
+        return { k: (count, [ perCell[rank[i]] for i in range(len(cells)) ]) for k,(count,perCell) in cached[1].items() if k <= maxMines }, cached[2]
+    
+    
+    @staticmethod
+    def constraintPropagator(nCells, constraints):
+        """ apply(i, isMine, sign): assigns (sign=1) or unassigns (sign=-1) the cell i of a component, and tells if the
+            constraints of the cell can still be met. Assignments have to be undone in reverse order """
+        need    = [ n for n,_ in constraints ]                                              # mines still to place for each constraint
+        free    = [ len(idxs) for _,idxs in constraints ]                                   # cells not assigned yet for each constraint
+        ofCell  = [ [] for _ in range(nCells) ]
+        for c,(_,idxs) in enumerate(constraints):
+            for i in idxs: ofCell[i].append(c)
+        
+        def apply(i, isMine, sign):
+            ok = True
+            for c in ofCell[i]:
+                free[c] -= sign
+                need[c] -= sign * isMine
+                ok = ok and 0 <= need[c] <= free[c]
+            return ok
+        return apply
+    
+    
+    def solveComponent(self, cells, constraints, maxMines):
+        """ Enumerate by backtracking all the valid mines configurations of one component.
+            Returns a dict: number of mines -> (number of configurations, list of the number of configurations where each cell is a mine),
+            or None if that takes more than MAX_CANDIDATES tries """
+        nCells  = len(cells)
+        apply   = self.constraintPropagator(nCells, constraints)
+        
+        result, mines = {}, []
+        tried = [0] * nCells                                                                # 0: nothing tried yet, 1: "safe" tried, 2: "mine" tried too
+        i, nCandidates = 0, 0
+        while i >= 0:
+            if i == nCells:                                                                 # valid configuration: archive it
+                archive = result.setdefault(len(mines), [0, [0]*nCells])
+                archive[0] += 1
+                for j in mines: archive[1][j] += 1
+                i -= 1
+                continue
             
-            borderUnknowns = { pos2 for pos in self.posToWorkOn for pos2 in self.lookaroundThisPos(pos)['?'] }      # '?' that are joined to the current posToWorkOn...
-            borderUnknowns |= { pos2 for pos in borderUnknowns for pos2 in self.lookaroundThisPos(pos)['?'] }       # ...then add the "next layer" of "?", ot be able to make more guesses on the remaining farther squares
+            if tried[i]:                                                                    # undo the previous try at this level
+                apply(i, tried[i]-1, -1)
+                if tried[i] == 2: mines.pop()
+            if tried[i] == 2:
+                tried[i] = 0; i -= 1
+                continue
             
-            for n in range(rMines if not (self.unknowns-borderUnknowns) else 1, min(rMines, len(borderUnknowns)-1)+1):
-                for posMines in combinations(borderUnknowns, n):
-                    setPosMines = set(posMines)
-                    for pos in self.posToWorkOn:
-                        around = self.lookaroundThisPos(pos)
-                        if self.getValAt(pos) != len(around['x']) + len(around ['?'] & setPosMines): break
-                    else:
-                        matchPos.append(setPosMines)                                                                # if the for loop execute until its end, the current position is valid. Archive it.
+            isMine   = tried[i]
+            tried[i] += 1
+            nCandidates += 1
+            if nCandidates > self.MAX_CANDIDATES: break
+            if isMine: mines.append(i)
+            if apply(i, isMine, 1) and len(mines) <= maxMines: i += 1
+        
+        if self.stats: self.stats.add('candidates', nCandidates)
+        return { k:tuple(v) for k,v in result.items() } if nCandidates <= self.MAX_CANDIDATES else None
+    
+    
+    def sampleComponent(self, cells, constraints, maxMines):
+        """ Estimate of solveComponent's result, for the components too big to enumerate (Knuth's estimator): each random walk
+            down the backtracking tree picks one of the valid choices for each cell, and the configuration it reaches stands
+            for the product of the numbers of choices met on the way. Dead ends count for nothing. Seeded: reproducible """
+        nCells = len(cells)
+        apply  = self.constraintPropagator(nCells, constraints)
+        rnd    = random.Random(nCells)
+        
+        def isValid(i, isMine):
+            ok = apply(i, isMine, 1)
+            apply(i, isMine, -1)
+            return ok
+        
+        result = {}
+        for _ in range(self.SAMPLES):
+            weight, mines, done = 1, [], []
+            for i in range(nCells):
+                choices = [ isMine for isMine in (0,1) if (not isMine or len(mines) < maxMines) and isValid(i, isMine) ]
+                if not choices: weight = 0; break
+                isMine  = rnd.choice(choices)
+                weight *= len(choices)
+                apply(i, isMine, 1)
+                done.append((i, isMine))
+                if isMine: mines.append(i)
+            for i,isMine in reversed(done): apply(i, isMine, -1)
+            
+            if weight:
+                archive = result.setdefault(len(mines), [0, [0]*nCells])
+                archive[0] += weight / self.SAMPLES
+                for j in mines: archive[1][j] += weight / self.SAMPLES
+        
+        if self.stats: self.stats.add('candidates', self.SAMPLES * nCells)
+        return { k:tuple(v) for k,v in result.items() }
+    
+    
+    @staticmethod
+    def feasibleMineCounts(countsPerComponent, rMines, nOthers):
+        """ Keep, for each component, only the numbers of mines that can be combined with the other components
+            while leaving between 0 and nOthers mines for the unconstrained '?'.
+            Returns the list of those sets, and the set of possible numbers of mines left for the unconstrained '?' """
+        sums = lambda a,b: { x+y for x in a for y in b if x+y <= rMines }
+        prefix = [{0}]
+        for ks in countsPerComponent: prefix.append(sums(prefix[-1], ks))
+        suffix = [{0}]
+        for ks in reversed(countsPerComponent): suffix.append(sums(suffix[-1], ks))
+        suffix.reverse()
+        
+        feasibles = []
+        for i,ks in enumerate(countsPerComponent):
+            elsewhere = sums(prefix[i], suffix[i+1])
+            feasibles.append({ k for k in ks if any(0 <= rMines-k-s <= nOthers for s in elsewhere) })
+        
+        restCounts = { rMines-s for s in prefix[-1] if 0 <= rMines-s <= nOthers }
+        return feasibles, restCounts
+
+
+
+
+def generateBoard(seed, lX, lY, density):
+    """ Reproducible random board: returns the starting mapStr (the '0' region around one random '0' is open),
+        the number of mines and a BoardOracle of the full solution """
+    rnd    = random.Random(seed)
+    cells  = [ (x,y) for x in range(lX) for y in range(lY) ]
+    mines  = set(rnd.sample(cells, max(1, min(len(cells)-1, round(len(cells)*density)))))
+    around = lambda x,y: [ (x+dx,y+dy) for dx in range(-1,2) for dy in range(-1,2) if (dx,dy) != (0,0) and 0 <= x+dx < lX and 0 <= y+dy < lY ]
+    board  = { pos: 'x' if pos in mines else str(sum( pos2 in mines for pos2 in around(*pos) )) for pos in cells }
+    
+    zeros, opened = [ pos for pos in cells if board[pos] == '0' ], set()
+    queue  = [rnd.choice(zeros)] if zeros else []
+    while queue:                                                                # Flood the '0' region around the starting position
+        pos = queue.pop()
+        if pos in opened: continue
+        opened.add(pos)
+        if board[pos] == '0': queue.extend(around(*pos))
+    opened = { pos for pos in opened if board[pos] == '0' }                     # The game only shows the '0' to start with
+    
+    toStr  = lambda visible: '\n'.join(' '.join( board[(x,y)] if visible((x,y)) else '?' for y in range(lY)) for x in range(lX))
+    return toStr(opened.__contains__), len(mines), BoardOracle(toStr(lambda pos: True))
+
+
+def benchmark(sizes=((10,10), (30,30), (100,100)), densities=(0.1, 0.15, 0.2), seeds=range(20), guess=False, cache=None):
+    """ Solve the generated boards of each size/density configuration and yield one record of measures per configuration.
+        With 'guess', the boards are played in guessing mode and the solved ratio is the win rate.
+        With a DeductionCache, all the boards share it and its hit/miss statistics are reported. """
+    for (lX,lY),density in product(sizes, densities):
+        wallTime, reveals, roundTrips, nSolved, nUnsolved, nErrors, peakMemory = 0, 0, 0, 0, 0, 0, 0
+        stats = SolverStats()
+        for seed in seeds:
+            mapStr, nMines, oracle = generateBoard(seed, lX, lY, density)
+            start = time.perf_counter()
+            try:                   result = solve_mine(mapStr, nMines, oracle, stats, guess, cache)
+            except MineExploded:   result = None
+            wallTime   += time.perf_counter() - start
+            reveals    += oracle.reveals
+            roundTrips += oracle.roundTrips
+            nSolved    += result is not None and result != '?'
+            nUnsolved  += result == '?'
+            nErrors    += result is None
             
-            untouched = borderUnknowns - {flagPos for s in matchPos for flagPos in s}                               # search for '?' that are never marked in any of the valid combinations
+            mapStr, nMines, oracle = generateBoard(seed, lX, lY, density)     # Second run for the memory: tracemalloc slows everything down
+            tracemalloc.start()
+            try:                   solve_mine(mapStr, nMines, oracle, guess=guess)
+            except MineExploded:   pass
+            peakMemory = max(peakMemory, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
         
-            if len(matchPos) == 1:  self.flagThosePos(matchPos[0])                                                  # Flag the found mines if only 1 match
-            self.openThosePos(untouched)                                       
+        nBoards = len(seeds)
+        yield {'size': [lX,lY], 'density': density, 'boards': nBoards, 'guess': guess,
+               'wall_time': wallTime, 'time_per_board': wallTime/nBoards,
+               'reveals': reveals, 'round_trips': roundTrips,
+               'solved_ratio': nSolved/nBoards, 'unsolved_ratio': nUnsolved/nBoards, 'errors': nErrors,
+               'peak_memory': peakMemory, 'phases': stats.phases,
+               'cache': cache.asDict() if cache else None}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the MineSweeper solver on generated boards (one JSON record per line)")
+    parser.add_argument('--sizes',     default='10x10,30x30,100x100', help="comma separated list of LXxLY")
+    parser.add_argument('--densities', default='0.1,0.15,0.2',        help="comma separated list of mine densities")
+    parser.add_argument('--seeds',     default=20, type=int,          help="number of boards per configuration")
+    parser.add_argument('--guess',     action='store_true',           help="play in guessing mode (solved_ratio is then the win rate)")
+    parser.add_argument('--cache',     default=None,                  help="share a DeductionCache between the boards, persisted in this file (JSON)")
+    parser.add_argument('--windows',   action='store_true',           help="let the DeductionCache hold the 5x5 windows deductions too")
+    parser.add_argument('--out',       default=None,                  help="output file (default: stdout)")
+    args = parser.parse_args()
+    
+    sizes     = [ tuple(map(int, size.split('x'))) for size in args.sizes.split(',') ]
+    densities = [ float(density) for density in args.densities.split(',') ]
+    out       = open(args.out, 'w') if args.out else sys.stdout
+    cache     = DeductionCache(path=args.cache, windows=args.windows) if args.cache else None
+    for record in benchmark(sizes, densities, range(args.seeds), args.guess, cache):
+        print(json.dumps(record), file=out, flush=True)
+    if cache: cache.save(args.cache)
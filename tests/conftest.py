@@ -0,0 +1,19 @@
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# main.py is imported by name; 2kata.py is not a valid module name
+sys.path.insert(0, str(ROOT))
+
+
+@pytest.fixture(scope='session')
+def kata():
+    spec = importlib.util.spec_from_file_location('kata', ROOT / '2kata.py')
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['kata'] = module
+    spec.loader.exec_module(module)
+    return module
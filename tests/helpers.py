@@ -0,0 +1,11 @@
+"""Shared helpers of the tests: the recorded results of the original
+implementations live in tests/data."""
+import json
+from pathlib import Path
+
+DATA = Path(__file__).resolve().parent / 'data'
+
+
+def load_data(name: str):
+    with open(DATA / name) as file:
+        return json.load(file)
@@ -0,0 +1,349 @@
+"""Tests of main.py, on seeded boards from generateBoard."""
+import asyncio
+import io
+import json
+import time
+from itertools import product
+
+import pytest
+
+import main
+from helpers import load_data
+
+BASELINE = load_data('minesweeper_baseline.json')
+
+
+def board_id(entry):
+    (lX, lY), density, seed = entry['size'], entry['density'], entry['seed']
+    return f'{lX}x{lY}-{density}-{seed}'
+
+
+def generate(entry):
+    return main.generateBoard(entry['seed'], *entry['size'], entry['density'])
+
+
+def solution(oracle):
+    return '\n'.join(' '.join(line) for line in oracle.board)
+
+
+def check(entry, result, oracle):
+    """Every board the original implementation solved is still solved; the
+    opened '0' cells are now worked on too, so some of the others are."""
+    if entry['solved']:
+        assert result == solution(oracle)
+    else:
+        assert result in ('?', solution(oracle))
+
+
+def stuck_boards(n, lX=30, lY=30, density=0.2):
+    """Boards after the simple deductions: most numbers of the frontier are
+    left to the pairwise search."""
+    for seed in range(n):
+        game = main.MineSweeper(*main.generateBoard(seed, lX, lY, density))
+        game.openAndFlag_OnTheFly()
+        yield game
+
+
+def reference_pairwise(game, pos):
+    """The pairwise search of intelligencia_OpenAndFlag, written with sets of
+    neighbors the way the dict-based board did."""
+    def around(pos):
+        return {pos + d for d in game.around}
+
+    def unknowns(pos):
+        return {pos2 for pos2 in around(pos)
+                if game.cells[pos2] == game.UNKNOWN}
+
+    rMines = [game.getMinesLeft(pos), 0]
+    markables, openables, knownParts = set(), set(), []
+    for pos2 in around(pos) & game.posToWorkOn:
+        rMines[1] = game.getMinesLeft(pos2)
+        onlys = [unknowns(pos) - unknowns(pos2),
+                 unknowns(pos2) - unknowns(pos)]
+        mInter = max(n - len(only) for n, only in zip(rMines, onlys))
+        if mInter <= 0 or 1 not in rMines:
+            continue
+        if unknowns(pos) & unknowns(pos2):
+            knownParts.append(unknowns(pos) & unknowns(pos2))
+        for i in range(2):
+            if len(onlys[i]) == rMines[i] - mInter:
+                markables |= onlys[i]
+            elif mInter == rMines[i]:
+                openables |= onlys[i]
+    union = set().union(*knownParts)
+    if (len(knownParts) == rMines[0]
+            and sum(map(len, knownParts)) == len(union)):
+        openables |= unknowns(pos) - union
+    return markables, openables
+
+
+@pytest.mark.parametrize('lX, lY', [(8, 8), (10, 15), (30, 30)])
+def test_flat_grid_round_trip(lX, lY):
+    mapStr, nMines, oracle = main.generateBoard(0, lX, lY, 0.15)
+    game = main.MineSweeper(mapStr, nMines, oracle)
+    assert str(game) == mapStr
+    assert isinstance(game.cells, bytearray)
+    assert len(game.cells) == (lX + 2) * (lY + 2)
+    other = main.MineSweeper(*main.generateBoard(1, lX, lY, 0.15))
+    assert other.around is game.around
+
+
+def test_pairwise_search_without_sets():
+    for game in stuck_boards(20):
+        for pos in game.posToWorkOn:
+            assert (game.intelligencia_OpenAndFlag(pos)
+                    == reference_pairwise(game, pos))
+
+
+def test_frontier_components_cover_the_frontier():
+    for game in stuck_boards(20):
+        components = game.frontierComponents()
+        cells = [pos for cells, _ in components for pos in cells]
+        assert len(cells) == len(set(cells))
+        assert set(cells) == {
+            pos + d for pos in game.posToWorkOn for d in game.around
+            if game.cells[pos + d] == game.UNKNOWN}
+        for cells, constraints in components:
+            for need, idxs in constraints:
+                assert 0 < need <= len(idxs) <= 8
+
+
+def brute_force(nCells, constraints):
+    """Every configuration of a component, tried one by one."""
+    result = {}
+    for config in product((0, 1), repeat=nCells):
+        if all(sum(config[i] for i in idxs) == need
+               for need, idxs in constraints):
+            count, perCell = result.get(sum(config), (0, [0] * nCells))
+            result[sum(config)] = (
+                count + 1, [a + b for a, b in zip(perCell, config)])
+    return {k: (count, tuple(perCell))
+            for k, (count, perCell) in result.items()}
+
+
+def test_component_backtracking_matches_brute_force():
+    checked = 0
+    for game in stuck_boards(40):
+        for cells, constraints in game.frontierComponents():
+            if len(cells) > 14:
+                continue
+            result = game.solveComponent(cells, constraints, len(cells))
+            assert ({k: (count, tuple(perCell))
+                     for k, (count, perCell) in result.items()}
+                    == brute_force(len(cells), constraints))
+            checked += 1
+    assert checked > 50
+
+
+@pytest.mark.parametrize('entry', BASELINE, ids=board_id)
+def test_matches_original_implementation(entry):
+    mapStr, nMines, oracle = generate(entry)
+    check(entry, main.solve_mine(mapStr, nMines, oracle), oracle)
+
+
+def test_counters_stay_up_to_date():
+    for entry in BASELINE[:40]:
+        game = main.MineSweeper(*generate(entry))
+        game.solve()
+        assert not game.dirty and not game.complexDirty
+        assert game.unknownsAround == game.countAround(game.UNKNOWN)
+        flags = game.countAround(game.FLAG)
+        assert {pos: n for pos, n in game.flagsAround.items() if n} == {
+            pos: n for pos, n in enumerate(flags) if n}
+        assert game.posToWorkOn == {
+            pos for pos in range(len(game.cells))
+            if game.cells[pos] < 9 and game.unknownsAround[pos]}
+
+
+def test_board_oracle_counts_batches():
+    for entry in BASELINE[:20]:
+        mapStr, nMines, oracle = generate(entry)
+        main.solve_mine(mapStr, nMines, oracle)
+        assert oracle.reveals == len(oracle.cache)
+        assert 0 < oracle.roundTrips <= oracle.reveals
+    assert oracle.roundTrips < oracle.reveals
+
+
+def test_async_oracle_counts_one_round_trip_per_batch():
+    for entry in BASELINE[:20]:
+        mapStr, nMines, oracle = generate(entry)
+        result = main.solve_mine(mapStr, nMines, oracle)
+        remote = main.AsyncBoardOracle(solution(oracle))
+        assert asyncio.run(
+            main.solve_mine_async(mapStr, nMines, remote)) == result
+        assert remote.board.reveals == oracle.reveals
+        assert remote.board.roundTrips == oracle.roundTrips
+
+
+class SlowOracle(main.BoardOracle):
+    def reveal_many(self, positions):
+        time.sleep(0.05)
+        return super().reveal_many(positions)
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_solve_many_streams_the_jobs(ordered):
+    boards = [generate(entry) for entry in BASELINE[:30]]
+    expected = [main.solve_mine(*generate(entry)) for entry in BASELINE[:30]]
+    results = list(main.solve_many(
+        boards, processes=2, chunksize=4, ordered=ordered))
+    if ordered:
+        assert [index for index, _ in results] == list(range(len(boards)))
+    assert dict(results) == dict(enumerate(expected))
+
+
+def test_solve_many_bounds_the_reorder_buffer():
+    pulled = 0
+
+    def jobs():
+        nonlocal pulled
+        mapStr, nMines, oracle = generate(BASELINE[0])
+        pulled += 1
+        yield mapStr, nMines, SlowOracle(solution(oracle))
+        for _ in range(500):
+            pulled += 1
+            yield mapStr, nMines, main.BoardOracle(solution(oracle))
+
+    results = main.solve_many(jobs(), processes=2, chunksize=1)
+    assert next(results)[0] == 0
+    # 4 results per process may wait for the first job, 2 chunks per
+    # process are in flight, and the first one may have been pulled early
+    assert pulled <= 4 * 2 + 2 * 2 + 1
+    assert len(list(results)) == 500
+
+
+@pytest.mark.parametrize('loader', ['fromStream', 'fromBuffer', 'fromFile'])
+def test_loaders_forward_every_argument(tmp_path, loader):
+    entry = next(entry for entry in BASELINE if entry['solved'])
+    mapStr, nMines, oracle = generate(entry)
+    source = {
+        'fromStream': io.BytesIO(mapStr.encode()),
+        'fromBuffer': mapStr.encode(),
+        'fromFile': tmp_path / 'board.txt',
+    }[loader]
+    if loader == 'fromFile':
+        source.write_bytes(mapStr.encode())
+    stats, cache = main.SolverStats(), main.DeductionCache()
+
+    game = getattr(main.MineSweeper, loader)(
+        source, nMines, oracle=oracle, stats=stats, guess=True, cache=cache)
+    assert (game.oracle, game.stats, game.guess, game.deductions) == (
+        oracle, stats, True, cache)
+    assert str(game) == mapStr
+    assert game.solve() == solution(oracle)
+    assert stats.boards == 1
+
+
+def test_flag_counters_are_sparse():
+    for entry in BASELINE[:20]:
+        game = main.MineSweeper(*generate(entry))
+        game.solve()
+        assert len(game.flagsAround) <= 8 * game.nFlagged
+
+
+@pytest.mark.parametrize('entry', BASELINE[:30], ids=board_id)
+def test_guess_never_returns_a_wrong_board(entry):
+    """A lost gamble gives '?' too; no board that can be solved without
+    guessing ever needs a guess."""
+    mapStr, nMines, oracle = generate(entry)
+    check(entry, main.solve_mine(mapStr, nMines, oracle, guess=True), oracle)
+
+
+@pytest.mark.parametrize('guess', [False, True])
+def test_sampled_components_stay_correct(monkeypatch, guess):
+    monkeypatch.setattr(main.MineSweeper, 'MAX_CANDIDATES', 20)
+    monkeypatch.setattr(main.MineSweeper, 'SAMPLES', 50)
+    for entry in BASELINE:
+        mapStr, nMines, oracle = generate(entry)
+        result = main.solve_mine(mapStr, nMines, oracle, guess=guess)
+        assert result in ('?', solution(oracle))
+
+
+def test_guess_runs_as_its_own_phase():
+    stats = main.SolverStats()
+    for entry in BASELINE[:30]:
+        try:
+            main.solve_mine(*generate(entry), stats=stats, guess=True)
+        except main.MineExploded:
+            pass
+    assert stats.phases['openSafestPos']['runs'] > 0
+
+
+def test_matrix_reduction_is_sound():
+    found = 0
+    for game in stuck_boards(40):
+        markables, openables = game.frontierMatrix_OpenAndFlag(
+            game.posToWorkOn)
+        truth = game.oracle.board
+        for pos in markables | openables:
+            x, y = game.toCoords(pos)
+            assert (truth[x][y] == 'x') == (pos in markables)
+        found += len(markables | openables)
+    assert found > 200
+
+
+def test_matrix_reduction_covers_the_pairwise_search():
+    for entry in BASELINE[:40]:
+        game = main.MineSweeper(*generate(entry))
+        while game.dirty or game.complexDirty:
+            game.openAndFlag_OnTheFly()
+            game.complexSearch_OpenAndFlag()
+        for pos in game.posToWorkOn:
+            assert game.intelligencia_OpenAndFlag(pos) == (set(), set())
+
+
+def test_matrix_reduction_subtracts_subsets():
+    """Columns 0-4 hold 2 mines, 0-1 one, 2-3 one: 4 is safe. No pair of
+    rows tells it: it takes the difference of the first two, then of that
+    and the third one."""
+    rows = main.np.array([0, 0, 0, 0, 0, 1, 1, 2, 2])
+    cols = main.np.array([0, 1, 2, 3, 4, 0, 1, 2, 3])
+    b = main.np.array([2, 1, 1])
+    isSafe, isMine, nRows = main.MineSweeper.reduceMatrix(rows, cols, b, 5, 1)
+    assert not isSafe.any() and not isMine.any()
+    isSafe, isMine, nRows = main.MineSweeper.reduceMatrix(rows, cols, b, 5, 8)
+    assert isSafe.tolist() == [False] * 4 + [True]
+    assert not isMine.any()
+    assert nRows > 3
+
+
+def test_pairwise_search_without_numpy(monkeypatch):
+    monkeypatch.setattr(main, 'np', None)
+    for entry in BASELINE[:30]:
+        mapStr, nMines, oracle = generate(entry)
+        check(entry, main.solve_mine(mapStr, nMines, oracle), oracle)
+
+
+@pytest.mark.parametrize('windows', [False, True])
+def test_shared_cache_gives_the_same_results(windows):
+    cache = main.DeductionCache(windows=windows)
+    for entry in BASELINE[:30]:
+        mapStr, nMines, oracle = generate(entry)
+        check(entry, main.solve_mine(mapStr, nMines, oracle, cache=cache),
+              oracle)
+    assert cache.hits
+
+
+def test_cached_windows_give_the_pairwise_deductions():
+    cache = main.DeductionCache(windows=True)
+    for game in stuck_boards(20):
+        game.deductions = cache
+        for pos in game.posToWorkOn:
+            expected = game.intelligencia_OpenAndFlag(pos)
+            assert game.intelligencia_Cached(pos) == expected
+            assert game.intelligencia_Cached(pos) == expected
+    assert cache.hits > cache.misses
+
+
+def test_deduction_cache_json_round_trip(tmp_path):
+    cache = main.DeductionCache(windows=True)
+    for entry in BASELINE[:20]:
+        main.solve_mine(*generate(entry), cache=cache)
+    path = tmp_path / 'cache.json'
+    cache.save(path)
+    with io.open(path) as file:
+        json.load(file)
+    loaded = main.DeductionCache(path=path)
+    assert len(loaded) == len(cache)
+    assert loaded.table == cache.table
+    assert list(loaded.table) == list(cache.table)
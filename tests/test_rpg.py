@@ -0,0 +1,522 @@
+"""Tests of 2kata.py: the greedy simulator against the actions of the
+original implementation; ReplayEngine, and the plans of the solvers, against
+a reference validator that replays the actions on a copy of the grid."""
+import io
+import json
+import random
+
+import pytest
+
+from helpers import load_data
+
+BASELINE = load_data('rpg_baseline.json')
+MOVES = {'>': (0, 1), '<': (0, -1), '^': (-1, 0), 'v': (1, 0)}
+ATTACKS = {'E': 2, 'D': 3}
+
+
+def reference_validate(field, actions) -> tuple[bool, int]:
+    """Replay the actions on a copy of the grid, the slow and obvious way:
+    (whether the demon lord was destroyed, index of the first illegal
+    action or number of actions)."""
+    grid = [list(row) for row in field]
+    height, width = len(grid), len(grid[0])
+    for x, row in enumerate(grid):
+        for y, value in enumerate(row):
+            if value in MOVES:
+                point, direction = (x, y), value
+                grid[x][y] = ' '
+    hp, attack, defense, kills = 3, 1, 1, 0
+    bag = {'C': 0, 'K': 0, 'H': 0}
+    paid = {}
+    boss_hp = 10
+
+    def value_at(x, y):
+        return grid[x][y] if 0 <= x < height and 0 <= y < width else '#'
+
+    def damage(point, exclude=None):
+        total = 0
+        for dx, dy in MOVES.values():
+            n_point = (point[0] + dx, point[1] + dy)
+            if n_point != exclude and value_at(*n_point) in ATTACKS:
+                total += max(0, ATTACKS[value_at(*n_point)] - defense)
+        return total
+
+    for step, action in enumerate(actions):
+        if boss_hp <= 0:
+            return False, step
+        dx, dy = MOVES[direction]
+        target = (point[0] + dx, point[1] + dy)
+        value = value_at(*target)
+        if action in MOVES:
+            direction = action
+            hp -= damage(point)
+        elif action == 'F':
+            if value not in 'CSXHK ':
+                return False, step
+            hp -= damage(point, exclude=target)
+            point = target
+            if value == 'S':
+                defense += 1
+            elif value == 'X':
+                attack += 1
+            elif value in bag:
+                bag[value] += 1
+            grid[target[0]][target[1]] = ' '
+        elif action == 'A' and value == 'E':
+            grid[target[0]][target[1]] = ' '
+            kills += 1
+            attack += kills % 3 == 0
+            hp -= damage(point)
+        elif action == 'A' and value == 'D':
+            boss_hp -= attack
+            if boss_hp > 0:
+                hp -= damage(point)
+        elif action == 'C' and value == 'M' and bag['C']:
+            bag['C'] -= 1
+            paid[target] = paid.get(target, 0) + 1
+            if paid[target] == 3:
+                grid[target[0]][target[1]] = ' '
+        elif action == 'K' and value in '|-' and bag['K']:
+            bag['K'] -= 1
+            grid[target[0]][target[1]] = ' '
+        elif action == 'H' and bag['H']:
+            bag['H'] -= 1
+            hp = 3 - damage(point)
+        else:
+            return False, step
+        if hp <= 0:
+            return False, step
+    return boss_hp <= 0, len(actions)
+
+
+def mutations(actions, n, seed):
+    """Plans close to a valid one: truncated, or with one action replaced,
+    inserted or removed."""
+    rnd = random.Random(seed)
+    for _ in range(n):
+        mutated = list(actions)
+        i = rnd.randrange(len(mutated))
+        kind = rnd.randrange(4)
+        if kind == 0:
+            del mutated[i:]
+        elif kind == 1:
+            mutated[i] = rnd.choice('<>^vFACKH')
+        elif kind == 2:
+            mutated.insert(i, rnd.choice('<>^vFACKH'))
+        else:
+            del mutated[i]
+        yield mutated
+
+
+SIZES = [(6, 8, 1), (8, 10, 1), (12, 14, 2), (16, 20, 4)]
+
+
+def dungeons(kata, height, width, scale, seeds=range(10)):
+    """Seeded dungeons from generate_dungeon, scaled like the benchmark's."""
+    for seed in seeds:
+        yield [''.join(row) for row in kata.generate_dungeon(
+            seed, height, width,
+            enemies=3 * scale, doors=scale, merchants=scale,
+            shields=2 * scale, dual_swords=3 * scale, health_kits=3 * scale,
+        )]
+
+
+def greedy_plans(kata, height, width, scale):
+    """(field, actions) for the seeded dungeons the simulator solves."""
+    for field in dungeons(kata, height, width, scale):
+        try:
+            yield field, kata.rpg([list(row) for row in field])
+        except ValueError:
+            pass
+
+
+@pytest.mark.parametrize('height, width, scale', SIZES)
+def test_replay_engine_matches_reference(kata, height, width, scale):
+    for field, actions in greedy_plans(kata, height, width, scale):
+        engine = kata.ReplayEngine([list(row) for row in field])
+        plans = [actions, *mutations(actions, 30, seed=0)]
+        for plan, result in zip(plans, engine.replay_many(plans)):
+            assert (result.ok, result.step) == reference_validate(field, plan)
+        assert engine.replay(actions) == (True, len(actions), 'ok')
+
+
+def test_replay_engine_reports_first_illegal_step(kata):
+    field, actions = next(greedy_plans(kata, *SIZES[0]))
+    field = [list(row) for row in field]
+    result = kata.validate(field, actions + ['A'])
+    assert result.reason == 'the demon lord is already destroyed'
+    assert (result.ok, result.step) == (False, len(actions))
+    result = kata.validate(field, actions[:-1])
+    assert (result.ok, result.step) == (False, len(actions) - 1)
+    result = kata.validate(field, ['?'])
+    assert (result.ok, result.step) == (False, 0)
+
+
+def test_validate_many_shares_one_board(kata):
+    field, actions = next(greedy_plans(kata, *SIZES[1]))
+    grid = [list(row) for row in field]
+    results = list(kata.validate_many(grid, [actions, actions[:-1], actions]))
+    assert [result.ok for result in results] == [True, False, True]
+    assert [''.join(row) for row in grid] == field
+
+
+@pytest.mark.parametrize('weight', [1.0, 1.5])
+@pytest.mark.parametrize('height, width, scale', SIZES[:2])
+def test_planner_plans_are_valid(kata, height, width, scale, weight):
+    for field, greedy in greedy_plans(kata, height, width, scale):
+        actions = kata.rpg(
+            [list(row) for row in field], global_search=True, weight=weight)
+        assert reference_validate(field, actions) == (True, len(actions))
+        if weight == 1.0:
+            assert len(actions) <= len(greedy)
+
+
+def test_planner_heuristic_before_plan(kata):
+    field, _ = next(greedy_plans(kata, *SIZES[0]))
+    board = kata.Board(field=[list(row) for row in field])
+    planner = kata.StateSpacePlanner(board=board)
+    start = kata.SearchState(
+        board.to_cell(board.player_point), board.player_direction,
+        kata.Player.START_HP, 0, 0)
+    assert 0 <= planner.heuristic(start) <= len(planner.plan())
+
+
+def test_planner_pruning_keeps_the_shortest_plan(kata, monkeypatch):
+    # one more health kit made this dungeon's fight one action longer
+    field = next(dungeons(kata, *SIZES[1], seeds=[292]))
+    actions = kata.rpg([list(row) for row in field], global_search=True)
+    assert reference_validate(field, actions) == (True, 40)
+    monkeypatch.setattr(
+        kata.StateSpacePlanner, 'is_dominated', lambda *_: False)
+    assert len(kata.rpg(
+        [list(row) for row in field], global_search=True)) == 40
+
+
+def test_planner_falls_back_to_the_simulator(kata):
+    for field, greedy in greedy_plans(kata, *SIZES[1]):
+        board = kata.Board(field=[list(row) for row in field])
+        planner = kata.StateSpacePlanner(board=board, max_nodes=5)
+        with pytest.raises(kata.PlanningBudgetExceeded):
+            planner.plan()
+        assert planner.nodes_expanded == 5
+        actions, nodes = kata.solve_dungeon(
+            [list(row) for row in field], global_search=True, max_nodes=5)
+        assert actions == greedy
+        assert nodes > 5
+
+
+def test_rpg_many_passes_the_planner_options(kata):
+    fields = [field for field, _ in greedy_plans(kata, *SIZES[1])]
+    options = dict(global_search=True, weight=1.5, max_nodes=200, macro=True)
+    results = list(kata.rpg_many(
+        ([list(row) for row in field] for field in fields),
+        processes=2, chunksize=2, **options))
+    assert results == [
+        kata.rpg([list(row) for row in field], **options) for field in fields]
+    assert results != [
+        kata.rpg([list(row) for row in field], global_search=True)
+        for field in fields]
+
+
+@pytest.mark.parametrize('entry', BASELINE)
+def test_greedy_matches_original_implementation(kata, entry):
+    field = [list(row) for row in entry['field']]
+    if entry['actions'] is None:
+        with pytest.raises(ValueError):
+            kata.rpg(field)
+    else:
+        assert ''.join(kata.rpg(field)) == entry['actions']
+
+
+@pytest.mark.parametrize('height, width, scale', SIZES)
+def test_neighbor_table_matches_point_arithmetic(kata, height, width, scale):
+    for field in dungeons(kata, height, width, scale, seeds=range(3)):
+        board = kata.Board(field=[list(row) for row in field])
+        for x, y in ((x, y) for x in range(height) for y in range(width)):
+            n_points = {
+                d: (x + dx, y + dy) for d, (dx, dy) in MOVES.items()
+                if 0 <= x + dx < height and 0 <= y + dy < width
+                and field[x + dx][y + dy] != '#'
+            }
+            cell = board.to_cell(kata.Point(x, y))
+            if field[x][y] == '#':
+                assert board.cell_neighbors[cell] == {}
+                continue
+            assert board.find_neighboring_points((x, y)) == n_points
+            assert board.cell_neighbors[cell] == {
+                d: board.to_cell(kata.Point(*p)) for d, p in n_points.items()}
+
+
+def reference_damage(board, defense, cell, exclude=None):
+    """Damage on the cell from the enemies around it, read off the board."""
+    total = 0
+    for n_cell in board.cell_neighbors[cell].values():
+        value = board[board.points[n_cell]]
+        if n_cell != exclude and value in ATTACKS:
+            total += max(0, ATTACKS[value] - defense)
+    return total
+
+
+@pytest.mark.parametrize('height, width, scale', SIZES[:3])
+def test_threat_map_follows_the_rounds(kata, height, width, scale):
+    for field, _ in greedy_plans(kata, height, width, scale):
+        board = kata.Board(field=[list(row) for row in field])
+        simulator = kata.RPGSimulator(player=kata.Player(), board=board)
+        while not simulator.is_game_ove:
+            actions, hp, _, last_point = simulator.run_round()
+            simulator.player.set_new_hp_value(hp)
+            simulator.update(actions=actions, last_point=last_point)
+            if simulator.is_game_ove:
+                break
+            threat, defense = simulator.threat, simulator.player.defense
+            assert threat.defense == defense
+            for point in board.valid_points:
+                cell = board.to_cell(point)
+                assert threat.damage[cell] == reference_damage(
+                    board, defense, cell)
+                for d, n_cell in board.cell_neighbors[cell].items():
+                    assert threat.damage_facing(cell, d) == reference_damage(
+                        board, defense, cell, exclude=n_cell)
+
+
+def serpentine(rows, width):
+    """A corridor winding over `rows` rows of `width` cells, from the player
+    in one corner to the demon lord at the other end, by two shields."""
+    field = []
+    for i in range(rows):
+        field.append([' '] * width)
+        if i < rows - 1:
+            wall = ['#'] * width
+            wall[width - 1 if i % 2 == 0 else 0] = ' '
+            field.append(wall)
+    field[0][0] = '>'
+    field[2][3] = field[2 * (rows // 2)][5] = 'S'
+    field[-1][width - 1 if rows % 2 else 0] = 'D'
+    return [''.join(row) for row in field]
+
+
+@pytest.mark.parametrize('rows, width', [(3, 6), (9, 30), (25, 40)])
+def test_greedy_paths_along_a_long_corridor(kata, rows, width):
+    field = serpentine(rows, width)
+    actions = kata.rpg([list(row) for row in field])
+    assert reference_validate(field, actions) == (True, len(actions))
+    assert actions == kata.rpg(
+        [list(row) for row in field], global_search=True)
+    # width-1 steps along each row but the last one, where the demon lord
+    # takes a cell, 4 actions from one row to the next, 10 attacks
+    assert len(actions) == rows * (width - 1) - 1 + 4 * (rows - 1) + 10
+
+
+def reference_fight(hp, attack, health_kits, damage):
+    """The fight loop of the original RPGSimulator.parse_move."""
+    boss_hp = 10
+    actions = []
+    while True:
+        if hp == 1 and health_kits:
+            actions.append('H')
+            health_kits -= 1
+            hp = 3
+        else:
+            boss_hp -= attack
+            actions.append('A')
+        if boss_hp <= 0:
+            break
+        hp -= damage
+    return actions, hp
+
+
+def test_demon_lord_fight_matches_the_loop(kata):
+    kata.fight_demon_lord.cache_clear()
+    cases = [
+        (hp, attack, health_kits, damage)
+        for hp in range(1, 4) for attack in range(1, 9)
+        for health_kits in range(6) for damage in range(4)
+    ]
+    for case in cases + cases:
+        actions, hp = kata.fight_demon_lord(*case)
+        assert (list(actions), hp) == reference_fight(*case)
+    info = kata.fight_demon_lord.cache_info()
+    assert (info.hits, info.misses) == (len(cases), len(cases))
+    assert info.maxsize == 4096
+
+
+def test_counted_bag_behaves_like_a_list(kata):
+    rnd = random.Random(0)
+    player, bag = kata.Player(), []
+    for _ in range(500):
+        item = rnd.choice('CKH')
+        if rnd.random() < 0.5:
+            player.add_item_in_bag(item)
+            bag.append(item)
+        elif item in bag:
+            player.use_item_from_bag(item)
+            bag.remove(item)
+        else:
+            with pytest.raises(ValueError):
+                player.use_item_from_bag(item)
+        assert sorted(player.bag) == sorted(bag)
+        for item in 'CKHSX':
+            assert player.get_number_of_items_in_bag(item) == bag.count(item)
+    with pytest.raises(ValueError):
+        player.add_item_in_bag('S')
+
+
+def test_player_snapshot_round_trip(kata):
+    player = kata.Player()
+    player.add_item_in_bag(kata.COIN)
+    player.equip_shield()
+    snapshot = player.snapshot()
+    assert hash(snapshot) == hash(player.snapshot())
+    assert snapshot == player.snapshot()
+    assert (snapshot.coins, snapshot.defense) == (1, 2)
+    with pytest.raises(AttributeError):
+        snapshot.hp = 0
+    player.register_defeated_enemy()
+    player.use_item_from_bag(kata.COIN)
+    assert snapshot != player.snapshot()
+    assert (snapshot.coins, snapshot.enemies_killed) == (1, 0)
+    with pytest.raises(AttributeError):
+        player.gold = 1
+
+
+def test_generate_dungeon_is_reproducible(kata):
+    field = kata.generate_dungeon(3, 8, 10)
+    assert field == kata.generate_dungeon(3, 8, 10)
+    assert field != kata.generate_dungeon(4, 8, 10)
+    assert kata.is_connected(field)
+    counts = {value: sum(row.count(value) for row in field) for value in 'DEK'}
+    assert counts == {'D': 1, 'E': 3, 'K': 1}
+
+
+def test_generate_dungeon_gives_up(kata):
+    with pytest.raises(ValueError):
+        kata.generate_dungeon(0, 6, 6, walls=0.6, attempts=5)
+    with pytest.raises(ValueError):
+        kata.generate_dungeon(0, 2, 2)
+
+
+def test_rpg_many_keeps_the_order(kata):
+    fields = [field for height, width, scale in SIZES[:2]
+              for field in dungeons(kata, height, width, scale)]
+    results = list(kata.rpg_many(
+        ([list(row) for row in field] for field in fields),
+        processes=2, chunksize=3))
+    assert len(results) == len(fields)
+    for field, result in zip(fields, results):
+        try:
+            assert result == kata.rpg([list(row) for row in field])
+        except ValueError as e:
+            assert type(result) is ValueError and str(result) == str(e)
+
+
+def test_rpg_many_reads_the_stream_as_it_goes(kata):
+    slow = [list(row) for row in list(dungeons(kata, *SIZES[2]))[8]]
+    fast = list(dungeons(kata, *SIZES[0]))[8]
+    pulled = 0
+
+    def fields():
+        nonlocal pulled
+        pulled += 1
+        yield slow
+        for _ in range(60):
+            pulled += 1
+            yield [list(row) for row in fast]
+
+    results = kata.rpg_many(
+        fields(), processes=2, chunksize=3, global_search=True)
+    next(results)
+    # two chunks per process, and the one sent when the first came back
+    assert pulled <= (2 * 2 + 1) * 3
+    assert len(list(results)) == 60
+
+
+def test_rpg_many_reports_timeouts(kata):
+    fields = [[list(row) for row in field]
+              for field in dungeons(kata, 16, 20, 4, seeds=range(2))]
+    results = list(kata.rpg_many(
+        fields, processes=1, timeout=1e-4, global_search=True))
+    assert [type(result) for result in results] == [TimeoutError] * 2
+
+
+def test_search_stats_record_every_round(kata):
+    field, actions = next(greedy_plans(kata, *SIZES[1]))
+    hooked = []
+    stats = kata.SearchStats(hook=hooked.append, trace=True)
+    traced, nodes = kata.solve_dungeon(
+        [list(row) for row in field], stats=stats)
+    assert traced == actions
+    assert stats.records == hooked
+    assert [record['round'] for record in hooked] == list(range(len(hooked)))
+    assert sum(record['actions'] for record in hooked) == len(actions)
+    assert hooked[-1]['target'] == 'D'
+    assert stats.as_dict()['popped'] == nodes
+    assert stats.as_dict()['rounds'] == len(hooked)
+
+    out = io.StringIO()
+    stats.dump_trace(out, seed=1)
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert lines == [{'seed': 1, **record} for record in hooked]
+
+
+@pytest.mark.parametrize('height, width, scale', SIZES[:2])
+def test_corridor_planner_matches_the_cell_planner(kata, height, width, scale):
+    for field in dungeons(kata, height, width, scale):
+        plans = []
+        for macro in (False, True):
+            try:
+                plans.append(kata.rpg(
+                    [list(row) for row in field],
+                    global_search=True, max_nodes=None, macro=macro))
+            except ValueError:
+                plans.append(None)
+        cells, corridors = plans
+        if cells is None:
+            assert corridors is None
+        else:
+            assert reference_validate(field, corridors) == (True, len(cells))
+
+
+def test_links_cross_the_empty_cells_only(kata):
+    for field in dungeons(kata, *SIZES[1]):
+        board = kata.Board(field=[list(row) for row in field])
+        planner = kata.StateSpacePlanner(board=board, macro=True)
+        cell, direction = (
+            board.to_cell(board.player_point), board.player_direction)
+        bits, links = planner.links(cell, direction)
+        assert links
+        for end, e_d, facing, bit, paths in links:
+            assert planner.neighbors[end][e_d] == facing
+            assert planner.values[facing] != kata.EMPTY
+            assert planner.objects.get(facing, 0) == bit
+            assert bits & bit == bit
+            assert [steps for steps, *_ in paths] == sorted(
+                steps for steps, *_ in paths)
+            for steps, (once, twice, thrice), _, actions in paths:
+                assert len(actions) == steps
+                assert bits & once == once
+                assert once & twice == twice and twice & thrice == thrice
+                c, d = cell, direction
+                for action in actions:
+                    if action == kata.MOVE_FORWARD:
+                        c = planner.neighbors[c][d]
+                        assert planner.values[c] == kata.EMPTY
+                    else:
+                        d = action
+                assert (c, d) == (end, e_d)
+
+
+def test_corridors_stay_valid_until_an_object_met_is_consumed(kata):
+    field = next(dungeons(kata, *SIZES[0]))
+    board = kata.Board(field=[list(row) for row in field])
+    planner = kata.StateSpacePlanner(board=board, macro=True)
+    cell, direction = (
+        board.to_cell(board.player_point), board.player_direction)
+    corridors = planner.corridors(cell, direction, 0)
+    [(touched, _, _)] = planner.corridor_cache[cell, direction]
+    elsewhere = [bit for bit in planner.objects.values() if not bit & touched]
+    met = [bit for bit in planner.objects.values() if bit & touched]
+    assert elsewhere and met
+    for bit in elsewhere:
+        assert planner.corridors(cell, direction, bit) is corridors
+    assert planner.corridors(cell, direction, met[0]) is not corridors
+    assert len(planner.corridor_cache[cell, direction]) == 2